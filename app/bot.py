@@ -4,6 +4,7 @@ from dataclasses import dataclass
 from typing import Optional
 import logging
 import asyncio
+import time
 from uuid import uuid4
 from urllib.parse import urlsplit, urlunsplit
 from datetime import datetime, timedelta
@@ -18,11 +19,10 @@ from .config import settings
 from yookassa import Payment
 from yookassa.domain.exceptions import UnauthorizedError
 from .models import User, Order, OrderStatus, Subscription
-from .x3ui.client import X3UIClient
+from .x3ui.client import get_plain_client, get_x3ui_client
 from .db import async_session
 import base64
 import re
-import httpx
 from .utils import sanitize_config_link
 
 
@@ -73,85 +73,85 @@ async def _resolve_subscription_link(url: Optional[str]) -> Optional[str]:
     if not url:
         return None
     try:
-        from .config import settings as app_settings
         log = logging.getLogger("x3ui")
-        async with httpx.AsyncClient(timeout=10, follow_redirects=True, verify=app_settings.x3ui_verify_tls) as client:
-            for attempt in range(5):
-                resp = await client.get(url)
-                ctype = resp.headers.get("content-type", "").lower()
-                preview = None
-                try:
-                    preview = (resp.text or "").strip()[:160]
-                except Exception:
-                    preview = "<binary>"
-                log.info("Stage:sub_resolve attempt=%s url=%s -> %s ctype=%s preview=%s", attempt + 1, url, resp.status_code, ctype, preview)
-                if resp.status_code != 200:
-                    await asyncio.sleep(0.5)
-                    continue
+        # Pooled across calls (connections to the subscription host stay warm); closed on shutdown
+        client = get_plain_client(settings.x3ui_verify_tls)
+        for attempt in range(5):
+            resp = await client.get(url, timeout=10, follow_redirects=True)
+            ctype = resp.headers.get("content-type", "").lower()
+            preview = None
+            try:
+                preview = (resp.text or "").strip()[:160]
+            except Exception:
+                preview = "<binary>"
+            log.info("Stage:sub_resolve attempt=%s url=%s -> %s ctype=%s preview=%s", attempt + 1, url, resp.status_code, ctype, preview)
+            if resp.status_code != 200:
+                await asyncio.sleep(0.5)
+                continue
+            text = None
+            try:
+                text = resp.text.strip()
+            except Exception:
                 text = None
-                try:
-                    text = resp.text.strip()
-                except Exception:
-                    text = None
-                # Try to find direct link in plain text
+            # Try to find direct link in plain text
+            if text:
+                m = re.search(r"(vless://[^\s\"'<]+|vmess://[^\s\"'<]+|trojan://[^\s\"'<]+)", text)
+                if m:
+                    return m.group(1)
+            # Try base64 decode then search
+            try:
                 if text:
-                    m = re.search(r"(vless://[^\s\"'<]+|vmess://[^\s\"'<]+|trojan://[^\s\"'<]+)", text)
-                    if m:
-                        return m.group(1)
-                # Try base64 decode then search
+                    decoded = base64.b64decode(text + "==").decode("utf-8", errors="ignore")
+                    m2 = re.search(r"(vless://[^\s\"'<]+|vmess://[^\s\"'<]+|trojan://[^\s\"'<]+)", decoded)
+                    if m2:
+                        return m2.group(1)
+            except Exception:
+                pass
+            # Extract data URI QR from HTML
+            if text:
                 try:
-                    if text:
-                        decoded = base64.b64decode(text + "==").decode("utf-8", errors="ignore")
-                        m2 = re.search(r"(vless://[^\s\"'<]+|vmess://[^\s\"'<]+|trojan://[^\s\"'<]+)", decoded)
-                        if m2:
-                            return m2.group(1)
-                except Exception:
-                    pass
-                # Extract data URI QR from HTML
-                if text:
-                    try:
-                        mimg = re.search(r"data:image/png;base64,([A-Za-z0-9+/=]+)", text)
-                        if mimg:
-                            raw = base64.b64decode(mimg.group(1))
+                    mimg = re.search(r"data:image/png;base64,([A-Za-z0-9+/=]+)", text)
+                    if mimg:
+                        raw = base64.b64decode(mimg.group(1))
+                        try:
+                            from PIL import Image  # type: ignore
+                            from io import BytesIO
                             try:
-                                from PIL import Image  # type: ignore
-                                from io import BytesIO
-                                try:
-                                    from pyzbar.pyzbar import decode as qr_decode  # type: ignore
-                                except Exception:
-                                    qr_decode = None
-                                if qr_decode is not None:
-                                    img = Image.open(BytesIO(raw))
-                                    dec = qr_decode(img)
-                                    for d in dec:
-                                        data = d.data.decode("utf-8", errors="ignore")
-                                        if data.startswith(("vless://", "vmess://", "trojan://")):
-                                            return data
+                                from pyzbar.pyzbar import decode as qr_decode  # type: ignore
                             except Exception:
-                                pass
-                    except Exception:
-                        pass
-                # If response is PNG image, try QR decode
-                if "image/png" in ctype:
-                    try:
-                        raw = resp.content
-                        from PIL import Image  # type: ignore
-                        from io import BytesIO
-                        try:
-                            from pyzbar.pyzbar import decode as qr_decode  # type: ignore
+                                qr_decode = None
+                            if qr_decode is not None:
+                                img = Image.open(BytesIO(raw))
+                                dec = qr_decode(img)
+                                for d in dec:
+                                    data = d.data.decode("utf-8", errors="ignore")
+                                    if data.startswith(("vless://", "vmess://", "trojan://")):
+                                        return data
                         except Exception:
-                            qr_decode = None
-                        if qr_decode is not None:
-                            img = Image.open(BytesIO(raw))
-                            dec = qr_decode(img)
-                            for d in dec:
-                                data = d.data.decode("utf-8", errors="ignore")
-                                if data.startswith(("vless://", "vmess://", "trojan://")):
-                                    return data
+                            pass
+                except Exception:
+                    pass
+            # If response is PNG image, try QR decode
+            if "image/png" in ctype:
+                try:
+                    raw = resp.content
+                    from PIL import Image  # type: ignore
+                    from io import BytesIO
+                    try:
+                        from pyzbar.pyzbar import decode as qr_decode  # type: ignore
                     except Exception:
-                        pass
-                # If nothing extracted, wait a bit and retry (e.g., body == 'requesting')
-                await asyncio.sleep(0.6)
+                        qr_decode = None
+                    if qr_decode is not None:
+                        img = Image.open(BytesIO(raw))
+                        dec = qr_decode(img)
+                        for d in dec:
+                            data = d.data.decode("utf-8", errors="ignore")
+                            if data.startswith(("vless://", "vmess://", "trojan://")):
+                                return data
+                except Exception:
+                    pass
+            # If nothing extracted, wait a bit and retry (e.g., body == 'requesting')
+            await asyncio.sleep(0.6)
     except Exception:
         pass
     return None
@@ -203,7 +203,9 @@ async def cmd_start(message: types.Message, session: AsyncSession):
                         if p:
                             plan_days = p["days"]
                     expires_at = datetime.utcnow() + timedelta(days=plan_days)
-                    async with X3UIClient(
+                    # Seeds the panel client, so a retried activation of this payment re-sends the same client
+                    pay_id = order.payment_id if order else None
+                    async with get_x3ui_client(
                         settings.x3ui_base_url,
                         settings.x3ui_username,
                         settings.x3ui_password,
@@ -227,7 +229,8 @@ async def cmd_start(message: types.Message, session: AsyncSession):
                             inbound_id=settings.x3ui_inbound_id,
                             days=plan_days,
                             traffic_gb=settings.x3ui_client_traffic_gb,
-                            email_note=f"tg_{message.from_user.id}_{int(datetime.utcnow().timestamp())}",
+                            email_note=f"tg_{message.from_user.id}_{pay_id or int(time.time())}",
+                            idempotency_key=pay_id,
                         )
                         # Не формируем локально ссылку
                     # subscription URL
@@ -438,7 +441,7 @@ async def cb_plan_choose(callback: types.CallbackQuery, session: AsyncSession):
         origin = _origin_from_base_url(app_settings.public_base_url)
         success_url = deep_link if True else ((origin + f"/payments/yookassa/success?order_id={order_id}") if origin else None)
         try:
-            idempotence_key = f"order-{order_id}-{uuid4()}"
+            idempotence_key = f"order-{order_id}-{uuid4().hex}"
             # Build receipt for YooKassa (required for many accounts)
             item_name = (app_settings.yk_item_name or f"{plan['title']} VPN").strip()
             if len(item_name) > 128:
@@ -604,7 +607,7 @@ async def cmd_check(message: types.Message, session: AsyncSession):
             plan_days = p["days"]
     expires_at = datetime.utcnow() + timedelta(days=plan_days)
 
-    async with X3UIClient(
+    async with get_x3ui_client(
         settings.x3ui_base_url,
         settings.x3ui_username,
         settings.x3ui_password,
@@ -628,7 +631,8 @@ async def cmd_check(message: types.Message, session: AsyncSession):
             inbound_id=settings.x3ui_inbound_id,
             days=plan_days,
             traffic_gb=settings.x3ui_client_traffic_gb,
-            email_note=f"tg_{message.from_user.id}_{int(datetime.utcnow().timestamp())}",
+            email_note=f"tg_{message.from_user.id}_{order.payment_id or int(time.time())}",
+            idempotency_key=order.payment_id,
         )
     # subscription URL (if configured)
     sub_url = None
@@ -758,7 +762,7 @@ async def _auto_check_and_activate(bot: types.Bot, tg_user_id: int, order_id: in
                             plan_days = p["days"]
                     expires_at = datetime.utcnow() + timedelta(days=plan_days)
                 
-                async with X3UIClient(
+                async with get_x3ui_client(
                     settings.x3ui_base_url,
                     settings.x3ui_username,
                     settings.x3ui_password,
@@ -781,7 +785,8 @@ async def _auto_check_and_activate(bot: types.Bot, tg_user_id: int, order_id: in
                         inbound_id=settings.x3ui_inbound_id,
                         days=plan_days,
                         traffic_gb=settings.x3ui_client_traffic_gb,
-                        email_note=f"tg_{tg_user_id}_{int(datetime.utcnow().timestamp())}",
+                        email_note=f"tg_{tg_user_id}_{order.payment_id or int(time.time())}",
+                        idempotency_key=order.payment_id,
                     )
                 
                 async with async_session() as s:
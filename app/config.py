@@ -11,7 +11,7 @@ class Settings(BaseSettings):
 
     # Logging
     log_level: str = "INFO"           # root/app log level
-    x3ui_log_level: str = "DEBUG"     # logger "x3ui" level
+    x3ui_log_level: str = "INFO"      # logger "x3ui" level; DEBUG logs login URLs and cookie names
 
     # Payment provider switch
     payment_provider: str = "yookassa"  # yookassa
@@ -36,6 +36,13 @@ class Settings(BaseSettings):
     x3ui_client_days: int = 30
     x3ui_client_traffic_gb: int | None = None  # None = unlimited
     x3ui_verify_tls: bool = True  # set to False for self-signed certificates
+    # Extra URLs of the same panel (comma-separated), raced against X3UI_BASE_URL when a GET is slow
+    x3ui_mirror_urls: str | None = None
+    x3ui_hedge_delay_ms: int = 500
+    # Always run the raw-json/form addClient retries (for broken forks), even when the panel version is known
+    x3ui_compat_retries: bool = False
+    # How long a panel login is reused before logging in again (keep below the panel session timeout)
+    x3ui_login_ttl_sec: int = 1800
     # Subscription service settings (optional)
     x3ui_subscription_port: int | None = None
     x3ui_subscription_path: str | None = None  # e.g. "/xfvg/"
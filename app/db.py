@@ -12,8 +12,16 @@ async_session: async_sessionmaker[AsyncSession] = async_sessionmaker(
 )
 
 
+def _create_missing_indexes(sync_conn) -> None:
+    # create_all only indexes tables it creates; databases from older versions get new indexes here
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+
 async def init_db() -> None:
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_create_missing_indexes)
 
 __all__ = ["engine", "async_session", "init_db"]
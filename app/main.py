@@ -15,6 +15,7 @@ import logging
 from .db import init_db, async_session
 from .bot import router as bot_router
 from .payment.yookassa_pay import register_routes as register_yookassa_routes
+from .x3ui.client import close_shared_clients as close_x3ui_clients
 
 
 bot: Bot | None = None
@@ -41,7 +42,7 @@ async def lifespan(app: FastAPI):
     logging.basicConfig(level=level, format="%(levelname)s:%(name)s:%(message)s")
     # x3ui logger level
     try:
-        x3_level = getattr(logging, (settings.x3ui_log_level or "DEBUG").upper(), logging.DEBUG)
+        x3_level = getattr(logging, (settings.x3ui_log_level or "INFO").upper(), logging.INFO)
         logging.getLogger("x3ui").setLevel(x3_level)
     except Exception:
         pass
@@ -84,6 +85,7 @@ async def lifespan(app: FastAPI):
                 await polling_task
         if bot:
             await bot.session.close()
+        await close_x3ui_clients()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -1,9 +1,9 @@
 from __future__ import annotations
 
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Optional
 
-from sqlalchemy import String, Integer, BigInteger, DateTime, Boolean, ForeignKey, Text
+from sqlalchemy import String, Integer, BigInteger, DateTime, Boolean, ForeignKey, Index, Text, func, text, true
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -11,15 +11,24 @@ class Base(DeclarativeBase):
     pass
 
 
+def _utcnow() -> datetime:
+    # Naive UTC, as these columns have always stored (datetime.utcnow() is deprecated since Python 3.12)
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
 class User(Base):
     __tablename__ = "users"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     tg_user_id: Mapped[int] = mapped_column(BigInteger, unique=True, index=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=_utcnow, server_default=func.now())
 
-    orders: Mapped[list[Order]] = relationship("Order", back_populates="user")  # type: ignore  # noqa: F821
-    subscriptions: Mapped[list[Subscription]] = relationship("Subscription", back_populates="user")  # type: ignore  # noqa: F821
+    # Handlers query orders/subscriptions explicitly; an implicit per-user lazy load (N+1, and a MissingGreenlet
+    # under asyncio) raises instead. Use selectinload() in queries that really need the collections.
+    orders: Mapped[list[Order]] = relationship("Order", back_populates="user", lazy="raise")  # type: ignore  # noqa: F821
+    subscriptions: Mapped[list[Subscription]] = relationship(  # type: ignore  # noqa: F821
+        "Subscription", back_populates="user", lazy="raise"
+    )
 
 
 class OrderStatus:
@@ -34,29 +43,46 @@ class Order(Base):
     __tablename__ = "orders"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    # /check lists a user's orders newest first; on SQLite the index already carries the rowid (id) for the sort
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
     amount: Mapped[int] = mapped_column(Integer)
     currency: Mapped[str] = mapped_column(String(8), default="RUB")
     status: Mapped[str] = mapped_column(String(16), default=OrderStatus.NEW, index=True)
     external_id: Mapped[Optional[str]] = mapped_column(String(64), nullable=True, index=True)
     payment_url: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=_utcnow, server_default=func.now())
 
     user: Mapped[User] = relationship("User", back_populates="orders")
 
+    @property
+    def payment_id(self) -> Optional[str]:
+        """YooKassa payment id, stored after the plan code as "code|payment_id" once the payment is created."""
+        if self.external_id and "|" in self.external_id:
+            return self.external_id.split("|", 1)[1] or None
+        return None
+
 
 class Subscription(Base):
     __tablename__ = "subscriptions"
+    __table_args__ = (
+        # Serves both the per-user listings (leading user_id) and the "active sub created in the last
+        # 10 minutes" idempotency guard run before every provisioning
+        Index("ix_subscriptions_user_active_created", "user_id", "is_active", "created_at"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
-    inbound_id: Mapped[int] = mapped_column(Integer, default=1)
-    xray_uuid: Mapped[str] = mapped_column(String(64))
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    # Server defaults let core/bulk inserts (admin grants, imports) omit these columns; the Python defaults
+    # stay because create_all does not alter tables of existing databases
+    inbound_id: Mapped[int] = mapped_column(Integer, default=1, server_default=text("1"))
+    # Dashed string form, as the panel reports it; existing rows are stored this way and there are no migrations
+    xray_uuid: Mapped[str] = mapped_column(String(36))
     expires_at: Mapped[datetime] = mapped_column(DateTime)
-    is_active: Mapped[bool] = mapped_column(Boolean, default=True, index=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    is_active: Mapped[bool] = mapped_column(Boolean, default=True, server_default=true())
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=_utcnow, server_default=func.now())
 
     config_url: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
-    config_qr_png_b64: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    # Deferred: subscription listings never show the QR, so they don't pull it; access loads it on demand
+    config_qr_png_b64: Mapped[Optional[str]] = mapped_column(Text, nullable=True, deferred=True)
 
     user: Mapped[User] = relationship("User", back_populates="subscriptions")
@@ -7,7 +7,7 @@ from yookassa import Configuration, Payment
 from ..config import settings
 from ..db import async_session
 from ..models import Order, OrderStatus, User, Subscription
-from ..x3ui.client import X3UIClient
+from ..x3ui.client import get_x3ui_client
 from sqlalchemy import select
 from datetime import datetime, timedelta
 from urllib.parse import urlsplit, urlunsplit
@@ -117,7 +117,7 @@ def register_routes(app: FastAPI) -> None:
                 plan_days = plan_days_map.get(plan_code, settings.plan_days)
                 expires_at = datetime.utcnow() + timedelta(days=plan_days)
                 # Создадим клиента в x3-ui и сохраним подписку
-                async with X3UIClient(
+                async with get_x3ui_client(
                     settings.x3ui_base_url,
                     settings.x3ui_username,
                     settings.x3ui_password,
@@ -126,7 +126,8 @@ def register_routes(app: FastAPI) -> None:
                         inbound_id=settings.x3ui_inbound_id,
                         days=plan_days,
                         traffic_gb=settings.x3ui_client_traffic_gb,
-                        email_note=f"tg_{user.tg_user_id if user else 'unknown'}_{int(datetime.utcnow().timestamp())}",
+                        email_note=f"tg_{user.tg_user_id if user else 'unknown'}_{payment_id}",
+                        idempotency_key=payment_id,
                     )
                     # Не формируем локально ссылку
                 # Попробуем собрать ссылку подписки по email (note)
@@ -1,17 +1,499 @@
 from __future__ import annotations
 
+import asyncio
+import base64
+import functools
+import random
+import re
+import time
 import uuid
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import logging
-from datetime import datetime, timedelta
-from typing import Optional
+from io import BytesIO
+from typing import Awaitable, Callable, Optional, TypeVar
 
 import httpx
-from urllib.parse import urlsplit
+from urllib.parse import urlsplit, urlencode, quote
 import json
 
+from ..config import settings as app_settings
+
+try:
+    import orjson
+except ImportError:  # optional speedup, stdlib json is used otherwise
+    orjson = None
+
+try:
+    # Optional QR decoding of share links; resolved once, since a failed import is retried on every call
+    from PIL import Image  # type: ignore
+    from pyzbar.pyzbar import decode as qr_decode  # type: ignore
+except ImportError:
+    qr_decode = None
+
+try:
+    import h2  # noqa: F401  (httpx[http2]; lets concurrent probes share one TLS connection)
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+
+_LINK_KEYS = ("link", "url", "config", "configUrl", "vless", "vmess", "trojan")
+_LINK_CONTAINERS = ("obj", "data", "result", "client")
+_LINK_PREFIXES = ("vless://", "vmess://", "trojan://")
+_VLESS_TEMPLATE = "vless://{uuid}@{server}:{port}?{qs}#{tag}"
+# How long a discovered working endpoint is reused before probing all candidates again
+_ENDPOINT_CACHE_TTL = 3600.0
+# An endpoint that fails this many times in a row is skipped for _BREAKER_OPEN_SEC, then tried again
+_BREAKER_THRESHOLD = 3
+_BREAKER_OPEN_SEC = 300.0
+# A panel that is unreachable this many add_client calls in a row is not contacted for _PANEL_BREAKER_OPEN_SEC;
+# after that a single call is let through to test it
+_PANEL_BREAKER_OPEN_SEC = 30.0
+# Max number of endpoint probes in flight at once, to avoid hammering the panel
+_PROBE_CONCURRENCY = 4
+# Max add_client calls in flight per panel; a burst of payment callbacks queues instead of flooding the panel
+# (x _PROBE_CONCURRENCY stays below the pool's max_connections)
+_ADD_CLIENT_CONCURRENCY = 10
+# Panel version prefix -> addClient payload format accepted by that release line
+_VERSION_TO_FORMAT = {"0.": "v1", "1.": "v2_obj", "2.": "v2_str"}
+# addClient payload formats, in probing order
+_PAYLOAD_FORMATS = ("v1", "v2_obj", "v2_str")
+# Format passes once the version pins a format: that format alone, then the rest if it fails everywhere
+_PINNED_PASSES = {pf: ((pf,), tuple(o for o in _PAYLOAD_FORMATS if o != pf)) for pf in _PAYLOAD_FORMATS}
+# Probing order on upstream /panel/api/ routes: those are 2.x panels, which take settings as a JSON string
+_API_FORMAT_ORDER = ("v2_str", "v2_obj", "v1")
+# Panel API subpaths, tried with and without the base path (see _candidates)
+_LOGIN_SUBPATHS = ("login", "x3ui/login")
+_STATUS_SUBPATHS = ("panel/api/server/status", "server/status")
+_ADD_CLIENT_SUBPATHS = (
+    "panel/api/inbounds/addClient",
+    "api/inbounds/addClient",
+    "panel/inbound/addClient",
+    "xui/inbound/addClient",
+)
+_CLIENT_LINK_SUBPATHS = (
+    # Common API-style endpoints
+    "panel/api/inbounds/getClient",
+    "api/inbounds/getClient",
+    "panel/inbound/getClient",
+    "xui/inbound/getClient",
+    # Some forks expose 'share' endpoints
+    "panel/api/inbounds/clientShare",
+    "api/inbounds/clientShare",
+    "panel/inbound/clientShare",
+)
+_INBOUND_SUBPATHS = (
+    "panel/api/inbounds/get/{id}",
+    "panel/api/inbounds/list",
+    "api/inbounds/get/{id}",
+    "api/inbounds/list",
+)
+# Retries for 5xx / transport errors: capped exponential backoff with jitter, bounded by a per-call budget
+_MAX_RETRIES = 3
+_BACKOFF_BASE_SEC = 0.5
+_BACKOFF_CAP_SEC = 10.0
+_RETRY_BUDGET_SEC = 30.0
+# Default end-to-end budget of one add_client call, login included; a payment callback shouldn't hang on the panel
+_ADD_CLIENT_BUDGET_SEC = 10.0
+# Login POSTs are retried less: credential variants are tried in turn, and a flapping panel shouldn't see a storm
+_LOGIN_RETRIES = 2
+
+
+def _iter_link_values(data: dict):
+    for key in _LINK_KEYS:
+        yield data.get(key)
+    for container_key in _LINK_CONTAINERS:
+        container = data.get(container_key)
+        if isinstance(container, dict):
+            for key in _LINK_KEYS:
+                yield container.get(key)
+        elif isinstance(container, list):
+            for it in container:
+                if isinstance(it, dict):
+                    for key in _LINK_KEYS:
+                        yield it.get(key)
+
+
+def _extract_link(data) -> Optional[str]:
+    """Return the first share link found in a panel JSON response (top level, then obj/data/result/client)."""
+    if not isinstance(data, dict):
+        return None
+    return next(
+        (v for v in _iter_link_values(data) if isinstance(v, str) and v.startswith(_LINK_PREFIXES)),
+        None,
+    )
+
+
+_T = TypeVar("_T")
+
+
+def _public_hostname() -> Optional[str]:
+    if not app_settings.public_base_url:
+        return None
+    try:
+        return urlsplit(app_settings.public_base_url).hostname
+    except ValueError as e:
+        logging.getLogger("x3ui").warning("Failed to parse PUBLIC_BASE_URL: %s", e)
+        return None
+
+
+# Host advertised in generated configs; settings are loaded once per process
+_PUBLIC_HOSTNAME = _public_hostname()
+
+
+class _Outcome:
+    """Classification of one addClient attempt."""
+
+    SUCCESS = "success"
+    EXISTS = "exists"  # the client is already on the panel, e.g. an earlier attempt landed but its reply was lost
+    PERMANENT = "permanent"  # the panel understood the request and refused it; other candidates won't help
+    TRANSIENT = "transient"  # 5xx or 429
+    NO_REPLY = "no_reply"  # a network error, or the deadline ran out before a reply
+    FALLBACK = "fallback"  # wrong endpoint or payload shape; try the next candidate
+    UNREACHABLE = "unreachable"  # could not connect at all; every candidate is on the same host
+
+
+class _DeadlinePassed(httpx.TimeoutException):
+    """The caller's deadline ran out before a request could be sent; says nothing about the endpoint."""
+
+
+def _timeout_within(deadline_ts: float, base: httpx.Timeout, what: str) -> httpx.Timeout:
+    """base, shortened so one attempt cannot outlive deadline_ts (time.monotonic() based)."""
+    remaining = deadline_ts - time.monotonic()
+    if remaining <= 0:
+        raise _DeadlinePassed(f"deadline passed before {what}")
+    if remaining >= base.read:
+        return base
+    return httpx.Timeout(remaining, connect=min(base.connect, remaining), pool=base.pool)
+
+
+# Connection-level failures: the panel host is down or unreachable, so no other endpoint path will answer either
+_UNREACHABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+
+# Body messages from a panel refusing the client because its email/uuid is already registered
+_EXISTS_MARKERS = ("duplicate", "already exist")
+# Client uuids are derived from (panel, inbound, idempotency key or email) so a retried purchase re-sends the same client
+_CLIENT_UUID_NAMESPACE = uuid.UUID("6f1c3a52-2d4b-5e0a-9c87-3b1d0e4f5a69")
+
+
+# A dead panel should be detected on connect in seconds, not after a blanket 15s
+_PANEL_TIMEOUT = httpx.Timeout(connect=2.0, read=10.0, write=5.0, pool=1.0)
+# Compatibility retries and share-link lookups rarely succeed; don't let them hold the flow up
+_FALLBACK_TIMEOUT = httpx.Timeout(connect=1.0, read=5.0, write=5.0, pool=1.0)
+# Login (and the status probe after it) answers in well under a second on a healthy panel; fail fast and leave
+# the budget to addClient
+_LOGIN_TIMEOUT = httpx.Timeout(connect=2.0, read=3.0, write=3.0, pool=1.0)
+
+# Per-request content headers; X-Requested-With and Referer are client defaults (see _get_shared_client)
+_JSON_HEADERS = {"Accept": "application/json", "Content-Type": "application/json"}
+_JSON_UTF8_HEADERS = {"Accept": "application/json", "Content-Type": "application/json; charset=utf-8"}
+_FORM_HEADERS = {"Accept": "application/json", "Content-Type": "application/x-www-form-urlencoded"}
+
+# Panel API replies are tiny; anything larger is an HTML error page or a misrouted request, not worth parsing
+_MAX_JSON_BODY = 256 * 1024
+
+
+async def _read_capped(resp: httpx.Response, limit: int) -> httpx.Response:
+    """Buffer at most limit + 1 bytes of a streamed response, close it, and return a fully read copy.
+
+    The extra byte lets callers tell a truncated body (len > limit) from one that fit.
+    """
+    buf = bytearray()
+    try:
+        async for chunk in resp.aiter_bytes():
+            buf += chunk
+            if len(buf) > limit:
+                break
+    finally:
+        await resp.aclose()
+    # The copy holds decoded bytes, so drop headers describing the wire encoding
+    headers = [
+        (k, v) for k, v in resp.headers.multi_items() if k.lower() not in ("content-encoding", "content-length")
+    ]
+    return httpx.Response(
+        resp.status_code,
+        headers=headers,
+        content=bytes(buf[: limit + 1]),
+        request=resp.request,
+        extensions=resp.extensions,
+    )
+
+
+def _body_json(resp: httpx.Response) -> Optional[dict]:
+    """Parse a panel reply once; None if it is oversized, not JSON, or not an object."""
+    if len(resp.content) > _MAX_JSON_BODY:
+        return None
+    try:
+        data = _json_loads(resp.content)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _body_preview(resp: httpx.Response, limit: int = 400) -> str:
+    """Start of a reply body for logs; decodes only the bytes shown instead of the whole resp.text."""
+    return resp.content[:limit].decode("utf-8", errors="replace")
+
+
+def _body_msg(data: Optional[dict]) -> str:
+    msg = data.get("msg") if data is not None else None
+    return msg if isinstance(msg, str) else ""
+
+
+def _reply_ok_strict(data: dict) -> bool:
+    return data.get("success") is True
+
+
+def _reply_ok_loose(data: dict) -> bool:
+    if data.get("success") is True or data.get("ok") is True or data.get("code") == 0:
+        return True
+    status = data.get("status")
+    return isinstance(status, str) and status.lower() in ("success", "ok")
+
+
+def _is_success(data: Optional[dict], resp: httpx.Response, strict: bool) -> bool:
+    """Structural check of a parsed addClient reply; bare-text acks are only accepted off the strict API."""
+    if data is not None:
+        return _reply_ok_strict(data) if strict else _reply_ok_loose(data)
+    if strict or "html" in resp.headers.get("content-type", ""):
+        return False
+    # Forks that answer with a bare-text ack; scan a bounded prefix of the raw bytes only
+    return b"success" in resp.content[:512].lower()
+
+
+def _strict_success_reply(ep: str) -> bool:
+    """Upstream 3x-ui /panel/api/ endpoints always reply {"success": bool, "msg", "obj"}; forks vary elsewhere."""
+    return "/panel/api/" in ep
+
+
+def _flavor_of(ep: str) -> str:
+    """Panel flavor implied by an endpoint that answered: JSON API routes are modern 3x-ui."""
+    return "modern" if "/api/" in ep else "legacy"
+
+
+def _classify_status(status: int) -> str:
+    if status == 200:
+        return _Outcome.SUCCESS
+    if status == 409:
+        return _Outcome.EXISTS
+    if status == 422:
+        return _Outcome.PERMANENT
+    if status == 429 or status >= 500:
+        return _Outcome.TRANSIENT
+    return _Outcome.FALLBACK
+
+
+def _noop(*args, **kwargs) -> None:
+    return None
+
+
+def _stdlib_json_dumps(obj) -> bytes:
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+# Bound once at import so the hot path is a direct call into orjson when it is installed.
+# Both take str or bytes; _json_dumps always returns compact UTF-8 bytes.
+_json_loads: Callable[[str | bytes], object] = orjson.loads if orjson is not None else json.loads
+_json_dumps: Callable[[object], bytes] = orjson.dumps if orjson is not None else _stdlib_json_dumps
+
+
+def _as_dict(raw) -> dict:
+    """Normalize a settings field that panels return either as an object or as a JSON-encoded string."""
+    if isinstance(raw, dict):
+        return raw
+    if isinstance(raw, (str, bytes)) and raw:
+        try:
+            parsed = _json_loads(raw)
+        except ValueError:
+            return {}
+        return parsed if isinstance(parsed, dict) else {}
+    return {}
+
+
+def _normalize_inbound(inbound: dict) -> dict:
+    """Decode JSON-string stream settings in place, once per fetch, so consumers always see dicts."""
+    stream = _as_dict(inbound.get("streamSettings"))
+    for key in ("realitySettings", "tlsSettings", "wsSettings"):
+        if key in stream:
+            stream[key] = _as_dict(stream[key])
+    inbound["streamSettings"] = stream
+    return inbound
+
+
+def _decode_qr_link(raw: bytes) -> Optional[str]:
+    """Decode a QR code PNG and return the share link it carries (requires Pillow and pyzbar)."""
+    if qr_decode is None:
+        return None
+    try:
+        decoded = qr_decode(Image.open(BytesIO(raw)))
+    except (OSError, ValueError):
+        return None
+    for d in decoded:
+        data = d.data.decode("utf-8", errors="ignore")
+        if data.startswith(_LINK_PREFIXES):
+            return data
+    return None
+
+
+# One pooled HTTP client per panel, so keep-alive connections and TLS sessions survive across X3UIClient instances
+_shared_clients: dict[tuple[str, bool], httpx.AsyncClient] = {}
+
 
 @dataclass
+class _PanelSession:
+    """Login state for one panel, shared like its HTTP client (and cookie jar) across X3UIClient instances."""
+
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    bulkhead: asyncio.Semaphore = field(default_factory=lambda: asyncio.Semaphore(_ADD_CLIENT_CONCURRENCY))
+    # Session cookies live in the httpx cookie jar; re-login only after the TTL expires
+    last_login_mono: Optional[float] = None
+    # (url, "form"|"json") that last logged in successfully; tried alone before probing all variants
+    login_path: Optional[tuple[str, str]] = None
+    # addClient payload format pinned from the detected panel version (None = probe all)
+    payload_format: Optional[str] = None
+    version_probed: bool = False
+    # "modern" (JSON /api/ endpoints) or "legacy" (form endpoints), learned from the first API reply
+    flavor: Optional[str] = None
+    # Panel-wide breaker (see X3UIClient._panel_open): consecutive outages and when calls may resume
+    outages: int = 0
+    open_until: float = 0.0
+
+
+_panel_sessions: dict[tuple[str, bool], _PanelSession] = {}
+
+
+def _get_shared_client(base_url: str, verify: bool) -> httpx.AsyncClient:
+    client = _shared_clients.get((base_url, verify))
+    if client is None or client.is_closed:
+        transport = httpx.AsyncHTTPTransport(
+            verify=verify,
+            # Negotiated via ALPN; panels that don't offer h2 are spoken to over HTTP/1.1
+            http2=_HTTP2,
+            # One long-lived origin: keep connections warm so login/addClient/get_inbound skip the TLS handshake
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=60.0),
+            # Transparently redo a connect that failed at the TCP level (never a request that was sent)
+            retries=1,
+        )
+        client = httpx.AsyncClient(
+            base_url=base_url,
+            transport=transport,
+            timeout=_PANEL_TIMEOUT,
+            # A redirect on an API call means a wrong base URL, and following it can drop the POST body
+            follow_redirects=False,
+            # The panel's own frontend sends these on every API call; some forks reject requests without them
+            headers={
+                "User-Agent": "x3ui-client",
+                "X-Requested-With": "XMLHttpRequest",
+                "Referer": f"{base_url}/",
+            },
+        )
+        _shared_clients[(base_url, verify)] = client
+    return client
+
+
+def get_plain_client(verify: bool) -> httpx.AsyncClient:
+    """Pooled client without the panel's default headers, e.g. for subscription pages; closed with the rest."""
+    client = _shared_clients.get(("", verify))
+    if client is None or client.is_closed:
+        # Subscription pages usually live on the panel host too, so they get the same h2 negotiation
+        client = _shared_clients[("", verify)] = httpx.AsyncClient(verify=verify, timeout=_PANEL_TIMEOUT, http2=_HTTP2)
+    return client
+
+
+async def close_shared_clients() -> None:
+    """Close the pooled panel HTTP clients; called on application shutdown."""
+    clients = list(_shared_clients.values())
+    _shared_clients.clear()
+    _panel_sessions.clear()
+    _x3ui_clients.clear()
+    for client in clients:
+        await client.aclose()
+
+
+@functools.lru_cache(maxsize=64)
+def _candidates(base_path: str, subpaths: tuple[str, ...]) -> tuple[str, ...]:
+    """Endpoint paths for subpaths, first at the root and then under the panel base path.
+
+    Memoized: a client is created per request, but its inputs are fixed per panel.
+    """
+    candidates: list[str] = []
+    prefixes = ["", base_path] if base_path else [""]
+    for prefix in prefixes:
+        for sp in subpaths:
+            sp_clean = sp.lstrip("/")
+            if prefix:
+                candidates.append(f"/{prefix}/{sp_clean}")
+            else:
+                candidates.append(f"/{sp_clean}")
+    # de-duplicate preserving order
+    return tuple(dict.fromkeys(candidates))
+
+
+def _client_obj(client_uuid: str, email_note: str, total_bytes: int, expiry_ms: int) -> dict:
+    return {
+        "id": client_uuid,
+        "email": email_note,
+        "enable": True,
+        "limitIp": 0,
+        "totalGB": total_bytes,
+        "expiryTime": expiry_ms,
+        "subId": email_note,
+    }
+
+
+def _probe_formats(ep: str, pass_formats: tuple[str, ...]) -> tuple[str, ...]:
+    # Unknown version on an upstream API route: schedule the 2.x shape first within the probe limit
+    if pass_formats is _PAYLOAD_FORMATS and "/panel/api/" in ep:
+        return _API_FORMAT_ORDER
+    return pass_formats
+
+
+def _build_payload_v1(inbound_id: int, client: dict) -> dict:
+    # Correct format according to 3x-ui API documentation; some forks expect flow/reset present even if empty
+    return {"inboundId": inbound_id, "client": {**client, "flow": "", "reset": 0}}
+
+
+def _build_payload_v2_obj(inbound_id: int, client: dict) -> dict:
+    return {"id": inbound_id, "settings": {"clients": [client]}}
+
+
+def _build_payload_v2_str(inbound_id: int, client: dict) -> dict:
+    # Some panels require settings to be a JSON-encoded string
+    return {"id": inbound_id, "settings": _json_dumps({"clients": [client]}).decode()}
+
+
+# addClient body builder per payload format (see _PAYLOAD_FORMATS); a pinned format only ever calls its own
+_PAYLOAD_BUILDERS: dict[str, Callable[[int, dict], dict]] = {
+    "v1": _build_payload_v1,
+    "v2_obj": _build_payload_v2_obj,
+    "v2_str": _build_payload_v2_str,
+}
+
+
+@dataclass
+class _PayloadVariant:
+    """One addClient body, serialized once and reused for every endpoint and retry."""
+
+    name: str
+    payload: dict
+    raw: bytes
+    _form: Optional[bytes] = None
+
+    def form(self) -> bytes:
+        """Form-encoded body for the legacy retry, built on first use."""
+        if self._form is None:
+            if self.name == "v2_str":
+                # send id/settings fields directly; settings is already a compact JSON string
+                form = urlencode({"id": str(self.payload["id"]), "settings": self.payload["settings"]})
+            else:
+                # wrap the JSON body in a json field
+                form = urlencode({"json": self.raw.decode()})
+            self._form = form.encode()
+        return self._form
+
+
+@dataclass(slots=True, frozen=True)
 class X3UICreateClientResult:
     uuid: str
     note: str
@@ -19,44 +501,46 @@ class X3UICreateClientResult:
 
 
 class X3UIClient:
+    # (base_url, operation) -> (stored_at, endpoint info); shared because callers create a client per request
+    _endpoint_cache: dict[tuple[str, str], tuple[float, object]] = {}
+    # (base_url, endpoint) -> (consecutive failures, monotonic time the endpoint is skipped until)
+    _breakers: dict[tuple[str, str], tuple[int, float]] = {}
+
     def __init__(self, base_url: str, username: Optional[str], password: Optional[str]):
         self.base_url = base_url.rstrip("/")
         self.username = username
         self.password = password
-        from ..config import settings as app_settings
         verify = app_settings.x3ui_verify_tls
-        self._client = httpx.AsyncClient(base_url=self.base_url, timeout=15, follow_redirects=True, verify=verify)
+        self._client = _get_shared_client(self.base_url, verify)
         self._log = logging.getLogger("x3ui")
-        try:
-            parsed = urlsplit(self.base_url)
-            self._base_path = parsed.path.strip("/")
-        except Exception:
-            self._base_path = ""
+        base_parts = urlsplit(self.base_url)
+        self._base_path = base_parts.path.strip("/")
+        self._base_hostname = base_parts.hostname
+        self._compat_retries = app_settings.x3ui_compat_retries
+        # Callers create a client per request, so the login is kept per panel rather than per instance
+        session = _panel_sessions.get((self.base_url, verify))
+        if session is None:
+            session = _panel_sessions[(self.base_url, verify)] = _PanelSession()
+        self._session = session
+        self._login_ttl_sec = app_settings.x3ui_login_ttl_sec
+        # Mirror URLs of the same panel used to hedge slow requests (see _hedged)
+        mirrors = [u.strip().rstrip("/") for u in (app_settings.x3ui_mirror_urls or "").split(",") if u.strip()]
+        self._base_urls = [self.base_url] + [u for u in mirrors if u != self.base_url]
+        self._mirror_hostnames = {urlsplit(u).hostname for u in mirrors} - {self._base_hostname, None}
+        self._hedge_delay_sec = app_settings.x3ui_hedge_delay_ms / 1000
+        # Candidate endpoint paths depend only on base_url, so they are built once per client
+        self._login_paths = _candidates(self._base_path, _LOGIN_SUBPATHS)
+        self._status_paths = _candidates(self._base_path, _STATUS_SUBPATHS)
+        self._add_client_paths = _candidates(self._base_path, _ADD_CLIENT_SUBPATHS)
+        self._client_link_paths = _candidates(self._base_path, _CLIENT_LINK_SUBPATHS)
+        self._inbound_templates = _candidates(self._base_path, _INBOUND_SUBPATHS)
 
     async def __aenter__(self) -> "X3UIClient":
         return self
 
     async def __aexit__(self, exc_type, exc, tb) -> None:
-        await self._client.aclose()
-
-    def _candidates(self, subpaths: list[str]) -> list[str]:
-        candidates: list[str] = []
-        prefixes = ["", self._base_path] if self._base_path else [""]
-        for prefix in prefixes:
-            for sp in subpaths:
-                sp_clean = sp.lstrip("/")
-                if prefix:
-                    candidates.append(f"/{prefix}/{sp_clean}")
-                else:
-                    candidates.append(f"/{sp_clean}")
-        # de-duplicate preserving order
-        seen = set()
-        uniq: list[str] = []
-        for p in candidates:
-            if p not in seen:
-                seen.add(p)
-                uniq.append(p)
-        return uniq
+        # The HTTP client is shared and closed on shutdown via close_shared_clients()
+        return None
 
     async def _fetch_config_url(self, inbound_id: int, email_note: str, client_uuid: str) -> Optional[str]:
         """Try multiple known endpoints that some 3x-ui forks expose to get a client's share link.
@@ -64,198 +548,557 @@ class X3UIClient:
         We do NOT build the link locally here. We only accept what the server returns.
         """
         self._log.info("Stage:get_client_link start inbound_id=%s email=%s", inbound_id, email_note)
-        subpaths = [
-            # Common API-style endpoints
-            f"panel/api/inbounds/getClient",
-            f"api/inbounds/getClient",
-            f"panel/inbound/getClient",
-            f"xui/inbound/getClient",
-            # Some forks expose 'share' endpoints
-            f"panel/api/inbounds/clientShare",
-            f"api/inbounds/clientShare",
-            f"panel/inbound/clientShare",
+        endpoints = self._client_link_paths
+        fields = {
+            "inboundId": inbound_id, "email": email_note, "id": inbound_id,
+            "uuid": client_uuid, "remark": email_note, "subId": email_note,
+        }
+        # Requests to try per endpoint: (method, query params or encoded body, headers).
+        # POST bodies are encoded once here and reused for every endpoint.
+        requests: list[tuple[str, dict | bytes, dict]] = [
+            ("GET", fields, {}),
+            ("POST_JSON", _json_dumps(fields), _JSON_HEADERS),
+            ("POST_FORM", urlencode(fields).encode(), _FORM_HEADERS),
         ]
-        endpoints = self._candidates(subpaths)
-        # Requests to try per endpoint
-        requests: list[tuple[str, dict, dict]] = []  # (method, params_or_json, headers)
-        # GET with query params
-        requests.append(("GET", {"inboundId": inbound_id, "email": email_note, "id": inbound_id, "uuid": client_uuid, "remark": email_note, "subId": email_note}, {}))
-        # POST json
-        requests.append(("POST_JSON", {"inboundId": inbound_id, "email": email_note, "id": inbound_id, "uuid": client_uuid, "remark": email_note, "subId": email_note}, {
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-            "X-Requested-With": "XMLHttpRequest",
-            "Referer": f"{self.base_url}/",
-        }))
-        # POST form
-        requests.append(("POST_FORM", {"inboundId": str(inbound_id), "email": email_note, "id": str(inbound_id), "uuid": client_uuid, "remark": email_note, "subId": email_note}, {
-            "Accept": "application/json",
-            "Content-Type": "application/x-www-form-urlencoded",
-            "X-Requested-With": "XMLHttpRequest",
-            "Referer": f"{self.base_url}/",
-        }))
-
-        def _extract_link_from_body(text: str) -> Optional[str]:
-            try:
-                data = json.loads(text)
-            except Exception:
-                data = None
-            candidates: list[str] = []
-            if isinstance(data, dict):
-                # flat keys
-                for key in ["link", "url", "config", "configUrl", "vless", "vmess", "trojan"]:
-                    val = data.get(key)
-                    if isinstance(val, str):
-                        candidates.append(val)
-                # nested containers
-                for container_key in ["obj", "data", "result", "client"]:
-                    container = data.get(container_key)
-                    if isinstance(container, dict):
-                        for key in ["link", "url", "config", "configUrl", "vless", "vmess", "trojan"]:
-                            val = container.get(key)
-                            if isinstance(val, str):
-                                candidates.append(val)
-                    if isinstance(container, list):
-                        for it in container:
-                            if isinstance(it, dict):
-                                for key in ["link", "url", "config", "configUrl", "vless", "vmess", "trojan"]:
-                                    val = it.get(key)
-                                    if isinstance(val, str):
-                                        candidates.append(val)
+
+        def _extract_link_from_text(text: str) -> Optional[str]:
             # also accept raw text bodies already containing protocol
-            for c in candidates + ([text] if isinstance(text, str) else []):
-                if isinstance(c, str) and (c.startswith("vless://") or c.startswith("vmess://") or c.startswith("trojan://")):
-                    return c
+            if text.startswith(_LINK_PREFIXES):
+                return text
+            # try regex over raw HTML/text
+            m = re.search(r"(vless://[^\s\"'<]+)", text)
+            if not m:
+                m = re.search(r"(vmess://[^\s\"'<]+)", text)
+            if not m:
+                m = re.search(r"(trojan://[^\s\"'<]+)", text)
+            if m:
+                return m.group(1)
+            # Extract data URI PNG and try QR decode
+            mimg = re.search(r"data:image/png;base64,([A-Za-z0-9+/=]+)", text)
+            if mimg:
+                try:
+                    return _decode_qr_link(base64.b64decode(mimg.group(1)))
+                except ValueError:
+                    pass
             return None
 
-        for ep in endpoints:
+        async def _probe(ep: str, method: str, payload: dict | bytes, headers: dict) -> Optional[str]:
             full_url = f"{self.base_url}{ep}"
-            for method, payload, headers in requests:
-                try:
-                    if method == "GET":
-                        self._log.info("Stage:get_client_link GET %s", full_url)
-                        resp = await self._client.get(full_url, params=payload)
-                    elif method == "POST_JSON":
-                        self._log.info("Stage:get_client_link POST json %s", full_url)
-                        resp = await self._client.post(full_url, json=payload, headers=headers)
-                    else:
-                        from urllib.parse import urlencode as _urlencode
-                        body = _urlencode(payload)
-                        self._log.info("Stage:get_client_link POST form %s", full_url)
-                        resp = await self._client.post(full_url, content=body, headers=headers)
-                    ctype = resp.headers.get("content-type", "").lower()
-                    body_text = None
-                    try:
-                        body_text = resp.text
-                    except Exception:
-                        body_text = None
-                    self._log.info("Stage:get_client_link resp %s -> %s %s", full_url, resp.status_code, (body_text or "<binary>")[:400])
-                    if resp.status_code == 200:
-                        link = _extract_link_from_body(body_text or "")
-                        # If JSON-based extraction failed, try regex over raw HTML/text
-                        if not link and isinstance(body_text, str):
-                            import re as _re
-                            m = _re.search(r"(vless://[^\s\"'<]+)", body_text)
-                            if not m:
-                                m = _re.search(r"(vmess://[^\s\"'<]+)", body_text)
-                            if not m:
-                                m = _re.search(r"(trojan://[^\s\"'<]+)", body_text)
-                            if m:
-                                link = m.group(1)
-                            # Extract data URI PNG and try QR decode
-                            if not link:
-                                mimg = _re.search(r"data:image/png;base64,([A-Za-z0-9+/=]+)", body_text)
-                                if mimg:
-                                    b64 = mimg.group(1)
-                                    try:
-                                        import base64 as _b64
-                                        raw = _b64.b64decode(b64)
-                                        try:
-                                            from PIL import Image  # type: ignore
-                                            from io import BytesIO
-                                            try:
-                                                from pyzbar.pyzbar import decode as qr_decode  # type: ignore
-                                            except Exception:
-                                                qr_decode = None
-                                            if qr_decode is not None:
-                                                img = Image.open(BytesIO(raw))
-                                                dec = qr_decode(img)
-                                                for d in dec:
-                                                    data = d.data.decode("utf-8", errors="ignore")
-                                                    if data.startswith(("vless://", "vmess://", "trojan://")):
-                                                        link = data
-                                                        break
-                                        except Exception:
-                                            pass
-                                    except Exception:
-                                        pass
-                        # If body is binary image/png, try QR decode as well
-                        if not link and ("image/png" in ctype):
-                            try:
-                                raw = resp.content
-                                from PIL import Image  # type: ignore
-                                from io import BytesIO
-                                try:
-                                    from pyzbar.pyzbar import decode as qr_decode  # type: ignore
-                                except Exception:
-                                    qr_decode = None
-                                if qr_decode is not None:
-                                    img = Image.open(BytesIO(raw))
-                                    dec = qr_decode(img)
-                                    for d in dec:
-                                        data = d.data.decode("utf-8", errors="ignore")
-                                        if data.startswith(("vless://", "vmess://", "trojan://")):
-                                            link = data
-                                            break
-                            except Exception:
-                                pass
-                        if link:
-                            self._log.info("Stage:get_client_link success using %s; link: %s", full_url, link)
-                            return link
-                except Exception as e:
-                    self._log.debug("Stage:get_client_link error on %s: %s", full_url, e)
-                    continue
+            try:
+                if method == "GET":
+                    self._log.debug("Stage:get_client_link GET %s", full_url)
+                    resp = await self._client.get(full_url, params=payload, timeout=_FALLBACK_TIMEOUT)
+                elif method == "POST_JSON":
+                    self._log.debug("Stage:get_client_link POST json %s", full_url)
+                    resp = await self._client.post(full_url, content=payload, headers=headers, timeout=_FALLBACK_TIMEOUT)
+                else:
+                    self._log.debug("Stage:get_client_link POST form %s", full_url)
+                    resp = await self._client.post(full_url, content=payload, headers=headers, timeout=_FALLBACK_TIMEOUT)
+                if self._log.isEnabledFor(logging.DEBUG):
+                    self._log.debug(
+                        "Stage:get_client_link resp %s -> %s %s", full_url, resp.status_code, _body_preview(resp) or "<empty>"
+                    )
+                if resp.status_code != 200:
+                    return None
+                # Binary image/png body: QR decode only, never text-decode it
+                if "image/png" in resp.headers.get("content-type", "").lower():
+                    link = _decode_qr_link(resp.content)
+                else:
+                    # Parse JSON straight from bytes; decode to text only when a JSON lookup finds nothing
+                    link = _extract_link(_body_json(resp)) or _extract_link_from_text(resp.text)
+                if link:
+                    self._log.info("Stage:get_client_link success using %s; link: %s", full_url, link)
+                return link
+            except httpx.HTTPError as e:
+                self._log.debug("Stage:get_client_link error on %s: %s", full_url, e)
+                return None
+
+        cached = self._cached_endpoint("client_link")
+        if cached == "":
+            # Nothing answered with a link last time (upstream 3x-ui has none of these endpoints)
+            self._log.info("Stage:get_client_link skipped; panel exposes no share-link endpoint")
+            return None
+        if cached:
+            ep, idx = cached
+            link = await _probe(ep, *requests[idx])
+            if link:
+                return link
+            self._forget_endpoint("client_link")
+
+        async def _indexed(ep: str, idx: int) -> tuple[str, int, Optional[str]]:
+            return ep, idx, await _probe(ep, *requests[idx])
+
+        won = await self._race(
+            [
+                lambda ep=ep, idx=idx: _indexed(ep, idx)
+                for ep in endpoints
+                for idx in range(len(requests))
+            ],
+            accept=lambda r: bool(r[2]),
+        )
+        if won is not None:
+            self._remember_endpoint("client_link", won[:2])
+            return won[2]
+        self._remember_endpoint("client_link", "")
         self._log.info("Stage:get_client_link no link obtained")
         return None
 
-    async def login(self) -> None:
-        if not (self.username and self.password):
-            return
-        paths = self._candidates(["login", "x3ui/login"])  # try /login and explicit /x3ui/login
+    def _cached_endpoint(self, op: str):
+        entry = X3UIClient._endpoint_cache.get((self.base_url, op))
+        if entry is None or time.monotonic() - entry[0] > _ENDPOINT_CACHE_TTL:
+            return None
+        return entry[1]
+
+    def _remember_endpoint(self, op: str, value: object) -> None:
+        X3UIClient._endpoint_cache[(self.base_url, op)] = (time.monotonic(), value)
+
+    def _forget_endpoint(self, op: str) -> None:
+        X3UIClient._endpoint_cache.pop((self.base_url, op), None)
+
+    def _live_endpoints(self, endpoints: tuple[str, ...]) -> tuple[str, ...]:
+        """Drop endpoints whose breaker is open; if every breaker is open, try them all anyway."""
+        breakers = X3UIClient._breakers
+        if not breakers:
+            # Healthy steady state: hand back the precomputed tuple as-is
+            return endpoints
+        now = time.monotonic()
+        live = tuple(ep for ep in endpoints if breakers.get((self.base_url, ep), (0, 0.0))[1] <= now)
+        return live or endpoints
+
+    def _endpoint_failed(self, ep: str) -> None:
+        fails = X3UIClient._breakers.get((self.base_url, ep), (0, 0.0))[0] + 1
+        open_until = time.monotonic() + _BREAKER_OPEN_SEC if fails >= _BREAKER_THRESHOLD else 0.0
+        if fails == _BREAKER_THRESHOLD:
+            self._log.info("Stage:breaker open for %s%s", self.base_url, ep)
+        X3UIClient._breakers[(self.base_url, ep)] = (fails, open_until)
+
+    def _endpoint_ok(self, ep: str) -> None:
+        X3UIClient._breakers.pop((self.base_url, ep), None)
+
+    def _panel_open(self) -> bool:
+        """True while the panel breaker is open. Once it expires, one caller gets through as the trial."""
+        session = self._session
+        if session.outages < _BREAKER_THRESHOLD:
+            return False
+        now = time.monotonic()
+        if now < session.open_until:
+            return True
+        # Half-open: reserve the next window for this trial so concurrent callers keep failing fast
+        session.open_until = now + _PANEL_BREAKER_OPEN_SEC
+        return False
+
+    def _panel_failed(self) -> None:
+        session = self._session
+        session.outages += 1
+        if session.outages >= _BREAKER_THRESHOLD:
+            if session.outages == _BREAKER_THRESHOLD:
+                self._log.warning("Stage:breaker open for panel %s", self.base_url)
+            session.open_until = time.monotonic() + _PANEL_BREAKER_OPEN_SEC
+
+    def _panel_ok(self) -> None:
+        self._session.outages = 0
+        self._session.open_until = 0.0
+
+    async def _race(
+        self, probes: list[Callable[[], Awaitable[_T]]], accept: Callable[[_T], bool]
+    ) -> Optional[_T]:
+        """Run probes concurrently and return the first accepted result, cancelling the rest.
+
+        Probes are factories so the ones still waiting for a concurrency slot are never started.
+        """
+        sem = asyncio.Semaphore(_PROBE_CONCURRENCY)
+
+        async def _guarded(probe: Callable[[], Awaitable[_T]]) -> _T:
+            async with sem:
+                return await probe()
+
+        tasks = [asyncio.create_task(_guarded(p)) for p in probes]
         try:
-            cookie_names = ", ".join(self._client.cookies.keys()) if hasattr(self._client, "cookies") else "<none>"
-        except Exception:
-            cookie_names = "<error>"
-        self._log.info("Stage:login start; candidates=%s; cookies(before)=%s", paths, cookie_names)
-        for p in paths:
+            for fut in asyncio.as_completed(tasks):
+                result = await fut
+                if accept(result):
+                    return result
+            return None
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Reap the losers so their cancellation (or a late error) is consumed here, not logged as never retrieved
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _send(self, method: str, url: str, max_body: Optional[int], **kwargs) -> httpx.Response:
+        if max_body is None:
+            return await self._client.request(method, url, **kwargs)
+        # Stream so a verbose HTML error page is never buffered past max_body
+        resp = await self._client.send(self._client.build_request(method, url, **kwargs), stream=True)
+        return await _read_capped(resp, max_body)
+
+    async def _hedged(self, method: str, ep: str, *, max_body: Optional[int] = None, **kwargs) -> httpx.Response:
+        """Send a request to base_url; if it has not answered within the hedge delay, race it against the mirrors.
+
+        The first request that completes without a transport error wins and the others are cancelled.
+        Only GETs are hedged: a duplicated addClient POST could be applied twice, or land on a mirror the returned
+        link does not point at, and 3x-ui ignores the Idempotency-Key header.
+        """
+        if len(self._base_urls) == 1 or method != "GET":
+            return await self._send(method, f"{self.base_url}{ep}", max_body, **kwargs)
+        mirrors = iter(self._base_urls[1:])
+        pending = {asyncio.create_task(self._send(method, f"{self.base_url}{ep}", max_body, **kwargs))}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=self._hedge_delay_sec, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                mirror = next(mirrors, None)
+                if mirror is not None:
+                    self._log.info("Stage:hedge %s %s -> %s", method, ep, mirror)
+                    pending.add(asyncio.create_task(self._send(method, f"{mirror}{ep}", max_body, **kwargs)))
+            raise error  # type: ignore[misc]
+        finally:
+            for task in pending:
+                task.cancel()
+            # Reap the losers as _race does, so a cancelled send never surfaces as an unretrieved task error
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def _share_session_with_mirrors(self) -> None:
+        # Panel session cookies are host-only; copy them so hedged requests to mirror hosts stay authenticated
+        for cookie in list(self._client.cookies.jar):
+            for host in self._mirror_hostnames:
+                self._client.cookies.set(cookie.name, cookie.value or "", domain=host, path=cookie.path)
+
+    def _session_fresh(self) -> bool:
+        return (
+            self._session.last_login_mono is not None
+            and time.monotonic() - self._session.last_login_mono < self._login_ttl_sec
+            and bool(self._client.cookies)
+        )
+
+    async def _ensure_login(self, deadline_ts: Optional[float] = None) -> Optional[bool]:
+        """Log in unless the session is fresh; returns the login result (see _login), True if it was fresh."""
+        if self._session_fresh():
+            return True
+        async with self._session.lock:
+            # Another task may have logged in while we were waiting for the lock
+            if self._session_fresh():
+                return True
+            ok = await self._login(deadline_ts)
+            if ok:
+                self._session.last_login_mono = time.monotonic()
+                if len(self._base_urls) > 1:
+                    self._share_session_with_mirrors()
+            return ok
+
+    async def _request_with_retry(
+        self, method: str, ep: str, *, deadline_ts: Optional[float] = None, **kwargs
+    ) -> httpx.Response:
+        """Send a request, retrying 429, 5xx and transport errors with jittered exponential backoff.
+
+        A numeric Retry-After overrides the computed delay (still capped). Other 4xx responses are returned as-is.
+        No retry is scheduled past deadline_ts (time.monotonic() based), and each attempt's read timeout is
+        shortened to the time left before it.
+        """
+        attempt = 0
+        while True:
+            retry_after = None
+            attempt_kwargs = kwargs
+            if deadline_ts is not None and "timeout" not in kwargs:
+                attempt_kwargs = {**kwargs, "timeout": _timeout_within(deadline_ts, _PANEL_TIMEOUT, f"{method} {ep}")}
             try:
-                full_url = f"{self.base_url}{p}"
-                self._log.debug("Stage:login POST form %s", full_url)
-                resp = await self._client.post(full_url, data={"username": self.username, "password": self.password})
-                if 200 <= resp.status_code < 400:
-                    try:
-                        cookie_names = ", ".join(self._client.cookies.keys()) if hasattr(self._client, "cookies") else "<none>"
-                    except Exception:
-                        cookie_names = "<error>"
-                    self._log.info("Stage:login success via %s; cookies=%s", full_url, cookie_names)
-                    return
-            except Exception as e:
-                self._log.debug("Stage:login failed via %s (form): %s", full_url, e)
-                pass
+                resp = await self._hedged(method, ep, **attempt_kwargs)
+                if resp.status_code < 500 and resp.status_code != 429:
+                    return resp
+                reason: object = resp.status_code
+                retry_after = resp.headers.get("retry-after")
+            except httpx.TransportError as e:
+                resp = None
+                reason = e
+            if retry_after is not None and retry_after.isdigit():
+                delay = min(_BACKOFF_CAP_SEC, float(retry_after))
+            else:
+                delay = min(_BACKOFF_CAP_SEC, _BACKOFF_BASE_SEC * 2**attempt) * (1 + random.uniform(0, 0.5))
+            if attempt >= _MAX_RETRIES or (deadline_ts is not None and time.monotonic() + delay >= deadline_ts):
+                if resp is None:
+                    raise reason  # type: ignore[misc]
+                return resp
+            self._log.info("Stage:retry %s %s after %s; sleeping %.2fs", method, ep, reason, delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _request(
+        self, method: str, ep: str, *, deadline_ts: Optional[float] = None, known: bool = False, **kwargs
+    ) -> httpx.Response:
+        """Authenticated panel request: on 401/403 the session is refreshed once and the request repeated.
+
+        Modern 3x-ui answers a stale session on /panel/api/ with 404, so that counts too for a known endpoint
+        (one that answered before); on a probe candidate a 404 usually just means a wrong path.
+        """
+        login_seen = self._session.last_login_mono
+        resp = await self._request_with_retry(method, ep, deadline_ts=deadline_ts, **kwargs)
+        if resp.is_redirect:
+            self._log.warning(
+                "Stage:request %s %s redirected to %s; check X3UI_BASE_URL",
+                method, ep, resp.headers.get("location"),
+            )
+        stale = resp.status_code in (401, 403) or (
+            resp.status_code == 404 and known and "/panel/api/" in ep
+        )
+        if stale and self.username and self.password:
+            self._log.info("Stage:auth %s on %s; re-login", resp.status_code, ep)
+            # Concurrent probes rejected by the same stale session trigger one re-login, not one each
+            if self._session.last_login_mono == login_seen:
+                self._session.last_login_mono = None
+            await self._ensure_login(deadline_ts)
+            resp = await self._request_with_retry(method, ep, deadline_ts=deadline_ts, **kwargs)
+        return resp
+
+    async def login(self, deadline_ts: Optional[float] = None) -> bool:
+        """Log in to the panel; no path is tried and no retry is scheduled past deadline_ts (time.monotonic())."""
+        return bool(await self._login(deadline_ts))
+
+    async def _login(self, deadline_ts: Optional[float]) -> Optional[bool]:
+        """login(), but None instead of False when not one login request got an HTTP reply (panel down)."""
+        if not (self.username and self.password):
+            return False
+        paths = self._login_paths
+        if self._log.isEnabledFor(logging.DEBUG):
+            self._log.debug(
+                "Stage:login start; candidates=%s; cookies(before)=%s", paths, ", ".join(self._client.cookies.keys())
+            )
+        creds = {"username": self.username, "password": self.password}
+        answered = False
+
+        async def _post(full_url: str, encoding: str) -> httpx.Response:
+            nonlocal answered
+            # Only 429/5xx and transport errors are retried; a 4xx (e.g. wrong credentials) is returned as-is
+            attempt = 0
+            while True:
+                timeout = (
+                    _LOGIN_TIMEOUT if deadline_ts is None
+                    else _timeout_within(deadline_ts, _LOGIN_TIMEOUT, f"login {full_url}")
+                )
+                self._log.debug("Stage:login POST %s %s", encoding, full_url)
+                error: Optional[httpx.TransportError] = None
+                try:
+                    if encoding == "form":
+                        resp = await self._client.post(full_url, data=creds, timeout=timeout)
+                    else:
+                        resp = await self._client.post(
+                            full_url, content=_json_dumps(creds), headers=_JSON_HEADERS, timeout=timeout
+                        )
+                    answered = True
+                    if resp.status_code < 500 and resp.status_code != 429:
+                        return resp
+                except httpx.TransportError as e:
+                    error = e
+                delay = min(_BACKOFF_CAP_SEC, _BACKOFF_BASE_SEC * 2**attempt) * (1 + random.uniform(0, 0.5))
+                if attempt >= _LOGIN_RETRIES or (deadline_ts is not None and time.monotonic() + delay >= deadline_ts):
+                    if error is not None:
+                        raise error
+                    return resp
+                self._log.info("Stage:login retry %s (%s); sleeping %.2fs", full_url, encoding, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+
+        async def _attempt(full_url: str, encoding: str) -> Optional[str]:
+            try:
+                resp = await _post(full_url, encoding)
+                # Redirects are not followed automatically; a 307/308 keeps the POST, so resolve it once here
+                if resp.status_code in (307, 308) and resp.next_request is not None:
+                    full_url = str(resp.next_request.url)
+                    self._log.info("Stage:login redirected to %s", full_url)
+                    resp = await _post(full_url, encoding)
+            except httpx.HTTPError as e:
+                self._log.debug("Stage:login failed via %s (%s): %s", full_url, encoding, e)
+                return None
+            if not 200 <= resp.status_code < 400:
+                return None
+            # Redirects are not followed, so a 3xx alone proves nothing (a wrong path may just bounce to the login
+            # page): the panel must set its session cookie or answer {"success": true}
+            data = _body_json(resp)
+            if data is not None and data.get("success") is False:
+                return None
+            if not (resp.cookies or (data is not None and _reply_ok_strict(data))):
+                self._log.debug("Stage:login %s (%s) -> %s without a session", full_url, encoding, resp.status_code)
+                return None
+            self._session.login_path = (full_url, encoding)
+            return full_url
+
+        winner = None
+        pinned = self._session.login_path
+        if pinned:
+            winner = await _attempt(*pinned)
+        if not winner:
+            self._session.login_path = None
+        # Modern panels take JSON credentials; form posts are only sent if no path accepts JSON,
+        # which keeps failed-login counters (and fail2ban-style guards) on the panel low.
+        # Paths are tried one at a time in candidate order: credentials are not raced against paths that may
+        # 404 or redirect, and the first path that really logs in is the one pinned.
+        for enc in ("json", "form"):
+            for p in paths:
+                if winner:
+                    break
+                if deadline_ts is not None and time.monotonic() >= deadline_ts:
+                    self._log.warning("Stage:login deadline reached; giving up")
+                    return False if answered else None
+                # The pinned variant was just tried
+                if (f"{self.base_url}{p}", enc) != pinned:
+                    winner = await _attempt(f"{self.base_url}{p}", enc)
+        if not winner:
+            return False if answered else None
+        self._log.info("Stage:login success via %s", winner)
+        if self._log.isEnabledFor(logging.DEBUG):
+            self._log.debug("Stage:login cookies=%s", ", ".join(self._client.cookies.keys()))
+        if not self._session.version_probed:
+            await self._detect_panel_version(deadline_ts)
+        return True
+
+    async def _detect_panel_version(self, deadline_ts: Optional[float] = None) -> None:
+        """Read the panel version from server/status and pin the matching addClient payload format.
+
+        Only a status reply marks the version as probed; if every status endpoint errored, the next login retries.
+        """
+        for ep in self._status_paths:
+            full_url = f"{self.base_url}{ep}"
             try:
-                full_url = f"{self.base_url}{p}"
-                self._log.debug("Stage:login POST json %s", full_url)
-                resp = await self._client.post(full_url, json={"username": self.username, "password": self.password})
-                if 200 <= resp.status_code < 400:
-                    try:
-                        cookie_names = ", ".join(self._client.cookies.keys()) if hasattr(self._client, "cookies") else "<none>"
-                    except Exception:
-                        cookie_names = "<error>"
-                    self._log.info("Stage:login success via %s; cookies=%s", full_url, cookie_names)
+                timeout = (
+                    _LOGIN_TIMEOUT if deadline_ts is None
+                    else _timeout_within(deadline_ts, _LOGIN_TIMEOUT, f"status {full_url}")
+                )
+                # Newer panels expose status via GET under /panel/api, older ones via POST
+                if "panel/api/" in ep:
+                    resp = await self._client.get(full_url, timeout=timeout)
+                else:
+                    resp = await self._client.post(full_url, timeout=timeout)
+                if resp.status_code != 200:
+                    continue
+                data = _json_loads(resp.content)
+            except (httpx.HTTPError, ValueError) as e:
+                self._log.debug("Stage:panel_version %s error: %s", full_url, e)
+                continue
+            self._session.version_probed = True
+            self._session.flavor = _flavor_of(ep)
+            obj = data.get("obj") if isinstance(data, dict) else None
+            version = obj.get("version") if isinstance(obj, dict) else None
+            if not isinstance(version, str):
+                continue
+            version = version.lstrip("vV")
+            for prefix, fmt in _VERSION_TO_FORMAT.items():
+                if version.startswith(prefix):
+                    self._session.payload_format = fmt
+                    self._log.info("Stage:panel_version %s -> payload format %s", version, fmt)
                     return
-            except Exception as e:
-                self._log.debug("Stage:login failed via %s (json): %s", full_url, e)
-                pass
+        self._log.info("Stage:panel_version unknown; probing all payload formats")
+
+    async def _post_add_client(
+        self,
+        ep: str,
+        variant: _PayloadVariant,
+        json_headers: dict[str, str] = _JSON_HEADERS,
+        deadline_ts: Optional[float] = None,
+        known: bool = False,
+    ) -> tuple[str, Optional[str]]:
+        """POST one payload variant to one addClient endpoint. Returns (outcome, config_url).
+
+        known marks the endpoint that worked last time (see _request).
+        """
+        full_url = f"{self.base_url}{ep}"
+        raw = variant.raw
+        # Per-attempt tracing decodes/slices bodies; it is DEBUG-only and skipped entirely otherwise
+        dbg = self._log.debug if self._log.isEnabledFor(logging.DEBUG) else _noop
+
+        def fallback_timeout() -> httpx.Timeout:
+            if deadline_ts is None:
+                return _FALLBACK_TIMEOUT
+            return _timeout_within(deadline_ts, _FALLBACK_TIMEOUT, f"POST {ep}")
+
+        try:
+            dbg("Stage:add_client try %s with payload %s", full_url, variant.name)
+            if dbg is not _noop:
+                dbg("Payload: %s", raw.decode())
+            # Try JSON first
+            resp = await self._request(
+                "POST", ep, deadline_ts=deadline_ts, known=known, max_body=_MAX_JSON_BODY, content=raw,
+                headers=json_headers,
+            )
+            if dbg is not _noop:
+                dbg("Stage:add_client resp %s -> %s %s", full_url, resp.status_code, _body_preview(resp))
+            data = _body_json(resp)
+            # Fallbacks for forks with broken JSON handling; skipped once the panel version is known
+            compat = self._compat_retries or self._session.payload_format is None
+            # If server complains about JSON parse, retry with raw JSON body
+            if compat and resp.status_code == 200 and "unexpected end of json input" in _body_msg(data).lower():
+                try:
+                    dbg("Stage:add_client retry(raw-json) %s", full_url)
+                    resp = await self._client.post(
+                        full_url, content=raw, headers=_JSON_UTF8_HEADERS, timeout=fallback_timeout()
+                    )
+                    if dbg is not _noop:
+                        dbg("Stage:add_client resp(raw-json) %s -> %s %s", full_url, resp.status_code, _body_preview(resp))
+                    data = _body_json(resp)
+                except httpx.HTTPError as e:
+                    self._log.debug("Stage:add_client raw-json retry failed: %s", e)
+            # If still not ok, try form-encoded as a last resort
+            if compat and resp.status_code == 200 and not resp.content.strip():
+                try:
+                    form = variant.form()
+                    dbg("Stage:add_client retry(form) %s", full_url)
+                    resp = await self._client.post(
+                        full_url, content=form, headers=_FORM_HEADERS, timeout=fallback_timeout()
+                    )
+                    if dbg is not _noop:
+                        dbg("Stage:add_client resp(form) %s -> %s %s", full_url, resp.status_code, _body_preview(resp))
+                    data = _body_json(resp)
+                except httpx.HTTPError as e:
+                    self._log.debug("Stage:add_client form retry failed: %s", e)
+            outcome = _classify_status(resp.status_code)
+            if outcome in (_Outcome.FALLBACK, _Outcome.TRANSIENT):
+                self._endpoint_failed(ep)
+            else:
+                # The endpoint exists and answered, even if it refused this payload
+                self._endpoint_ok(ep)
+            if outcome != _Outcome.SUCCESS:
+                self._log.warning(
+                    "Stage:add_client HTTP %s (%s) on %s: %s", resp.status_code, outcome, full_url, _body_preview(resp)
+                )
+                return outcome, None
+            self._log.debug("Stage:add_client parsed JSON: %s", data)
+            # Parse success and extract link
+            if _is_success(data, resp, _strict_success_reply(ep)):
+                return _Outcome.SUCCESS, _extract_link(data) if data is not None else None
+            self._log.warning("Stage:add_client body indicates failure on %s: %s", full_url, _body_preview(resp))
+            msg = _body_msg(data).lower()
+            if any(marker in msg for marker in _EXISTS_MARKERS):
+                return _Outcome.EXISTS, None
+            return _Outcome.FALLBACK, None
+        except _UNREACHABLE_ERRORS as e:
+            # Not the endpoint's fault, so no breaker bookkeeping
+            self._log.warning("Stage:add_client cannot connect to %s: %s", self.base_url, e)
+            return _Outcome.UNREACHABLE, None
+        except _DeadlinePassed:
+            return _Outcome.NO_REPLY, None
+        except httpx.HTTPError as e:
+            self._log.warning("Stage:add_client error on %s: %s", full_url, e)
+            self._endpoint_failed(ep)
+            return _Outcome.NO_REPLY, None
+
+    def _probe_passes(self) -> list[tuple[tuple[str, ...], tuple[str, ...]]]:
+        """(endpoints, payload formats) rounds of a cold addClient probe, most likely first."""
+        # Try multiple endpoint subpaths (with and without base path) and all payload formats
+        endpoints = self._live_endpoints(self._add_client_paths)
+        flavor = self._session.flavor
+        if flavor:
+            # Panel flavor is known: probe its endpoints first, the others only if all of those fail
+            preferred = tuple(ep for ep in endpoints if _flavor_of(ep) == flavor)
+            endpoint_groups = [preferred, tuple(ep for ep in endpoints if ep not in preferred)]
+        else:
+            endpoint_groups = [endpoints]
+        pinned = self._session.payload_format
+        passes = _PINNED_PASSES[pinned] if pinned else (_PAYLOAD_FORMATS,)
+        return [(group, formats) for group in endpoint_groups if group for formats in passes]
 
     async def add_client(
         self,
@@ -263,381 +1106,323 @@ class X3UIClient:
         days: int,
         traffic_gb: Optional[int],
         email_note: str,
+        deadline: Optional[float] = None,
+        idempotency_key: Optional[str] = None,
     ) -> X3UICreateClientResult:
-        await self.login()
-        try:
-            cookie_names = ", ".join(self._client.cookies.keys()) if hasattr(self._client, "cookies") else "<none>"
-        except Exception:
-            cookie_names = "<error>"
-        self._log.info("Stage:add_client start; cookies=%s", cookie_names)
-        client_uuid = str(uuid.uuid4())
-        expiry_ms = int((datetime.utcnow() + timedelta(days=days)).timestamp() * 1000)
-        total_gb_bytes = None
-        if traffic_gb is not None:
-            total_gb_bytes = int(traffic_gb) * 1024 * 1024 * 1024
+        """Create a client on the panel. deadline (time.monotonic() based) bounds the whole call, retries included;
+        it defaults to _ADD_CLIENT_BUDGET_SEC from when the call gets its bulkhead slot.
+
+        idempotency_key seeds the client uuid, so a retried purchase re-sends the same client and the panel's
+        "duplicate" reply can be taken as success; without it the uuid follows email_note. It must never repeat
+        across purchases (use the payment id, not a database row id that a reset or deletion can hand out again).
+        """
+        async with self._session.bulkhead:
+            return await self._add_client(inbound_id, days, traffic_gb, email_note, deadline, idempotency_key)
+
+    async def _add_client(
+        self,
+        inbound_id: int,
+        days: int,
+        traffic_gb: Optional[int],
+        email_note: str,
+        deadline: Optional[float] = None,
+        idempotency_key: Optional[str] = None,
+    ) -> X3UICreateClientResult:
+        deadline_ts = deadline if deadline is not None else time.monotonic() + _ADD_CLIENT_BUDGET_SEC
+        client_uuid = str(uuid.uuid5(_CLIENT_UUID_NAMESPACE, f"{self.base_url}:{inbound_id}:{idempotency_key or email_note}"))
+        if self._panel_open():
+            self._log.error("Stage:add_client skipped; panel %s is down (breaker open)", self.base_url)
+            return X3UICreateClientResult(uuid=client_uuid, note=email_note, config_url=None)
+        if await self._ensure_login(deadline_ts) is None:
+            # Not one login request got a reply: the panel is down, don't spend the rest of the budget probing it
+            self._panel_failed()
+            self._log.error("Stage:add_client skipped; panel %s did not answer the login", self.base_url)
+            return X3UICreateClientResult(uuid=client_uuid, note=email_note, config_url=None)
+        login_seen = self._session.last_login_mono
+        self._log.info("Stage:add_client start")
+        if self._log.isEnabledFor(logging.DEBUG):
+            self._log.debug("Stage:add_client cookies=%s", ", ".join(self._client.cookies.keys()))
+        # Lets panels/proxies that honour it drop a replayed addClient instead of creating the client twice
+        json_headers = {**_JSON_HEADERS, "Idempotency-Key": client_uuid}
+        expiry_ms = time.time_ns() // 1_000_000 + days * 86_400_000
+        total_gb_bytes = int(traffic_gb) << 30 if traffic_gb else 0
 
         self._log.info("Adding client: inbound_id=%s, days=%s, traffic_gb=%s, email=%s, uuid=%s", 
                       inbound_id, days, traffic_gb, email_note, client_uuid)
 
-        # Correct format according to 3x-ui API documentation
-        payload = {
-            "inboundId": inbound_id,
-            "client": {
-                "id": client_uuid,
-                "email": email_note,
-                "enable": True,
-                "limitIp": 0,
-                "totalGB": total_gb_bytes or 0,
-                "expiryTime": expiry_ms,
-                # Some forks expect these optional fields present even if empty/zero
-                "flow": "",
-                "subId": email_note,
-                "reset": 0,
-            },
-        }
+        client = _client_obj(client_uuid, email_note, total_gb_bytes, expiry_ms)
+        # Variants are built and serialized on first use, then reused for all endpoints and retries;
+        # with a pinned endpoint only that one format is ever built
+        built: dict[str, _PayloadVariant] = {}
 
-        # Try multiple endpoint subpaths (with and without base path) and both payload formats
-        subpaths = [
-            "panel/api/inbounds/addClient",
-            "api/inbounds/addClient",
-            "panel/inbound/addClient",
-            "xui/inbound/addClient",
-        ]
-        endpoints = self._candidates(subpaths)
-        payloads = [
-            ("v1", payload),
-            (
-                "v2_obj",
-                {
-                    "id": inbound_id,
-                    "settings": {
-                        "clients": [
-                            {
-                                "id": client_uuid,
-                                "email": email_note,
-                                "enable": True,
-                                "limitIp": 0,
-                                "totalGB": total_gb_bytes or 0,
-                                "expiryTime": expiry_ms,
-                                "subId": email_note,
-                            }
-                        ]
-                    },
-                },
-            ),
-            (
-                "v2_str",
-                {
-                    "id": inbound_id,
-                    # Some panels require settings to be a JSON-encoded string
-                    "settings": json.dumps(
-                        {
-                            "clients": [
-                                {
-                                    "id": client_uuid,
-                                    "email": email_note,
-                                    "enable": True,
-                                    "limitIp": 0,
-                                    "totalGB": total_gb_bytes or 0,
-                                    "expiryTime": expiry_ms,
-                                    "subId": email_note,
-                                }
-                            ]
-                        }
-                    ),
-                },
-            ),
-        ]
+        def _variant(pf_name: str) -> _PayloadVariant:
+            if pf_name not in built:
+                pf_payload = _PAYLOAD_BUILDERS[pf_name](inbound_id, client)
+                built[pf_name] = _PayloadVariant(pf_name, pf_payload, _json_dumps(pf_payload))
+            return built[pf_name]
 
-        for ep in endpoints:
+        outcomes: list[str] = []
+
+        async def _attempt(ep: str, pf_name: str, known: bool = False) -> tuple[str, str, str, Optional[str]]:
+            outcome, config_url = await self._post_add_client(ep, _variant(pf_name), json_headers, deadline_ts, known)
+            outcomes.append(outcome)
+            return ep, pf_name, outcome, config_url
+
+        # A permanent refusal ends the probe: every other candidate would be refused the same way.
+        # An "already exists" reply means this very client (same uuid/email) was created by another probe or try.
+        # An unreachable host ends it too, instead of waiting out a connect timeout per candidate.
+        decisive = (_Outcome.SUCCESS, _Outcome.EXISTS, _Outcome.PERMANENT, _Outcome.UNREACHABLE)
+        failed = (_Outcome.TRANSIENT, _Outcome.NO_REPLY, _Outcome.UNREACHABLE)
+
+        async def _probe() -> Optional[tuple[str, str, str, Optional[str]]]:
+            won = None
+            cached = self._cached_endpoint("addClient")
+            if cached:
+                # Endpoint/format that worked last time: try it alone before probing
+                ep, pf_name = cached
+                won = await _attempt(ep, pf_name, known=True)
+                if won[2] in failed:
+                    # The panel itself is failing (retries already spent); other endpoints won't fare better
+                    self._log.warning("Stage:add_client pinned endpoint %s unavailable; not probing alternatives", ep)
+                elif won[2] not in decisive:
+                    self._log.info("Stage:add_client cached endpoint %s failed; probing all", ep)
+                    self._forget_endpoint("addClient")
+                    won = None
+            if won is None:
+                for group, pass_formats in self._probe_passes():
+                    if time.monotonic() >= deadline_ts:
+                        self._log.warning("Stage:add_client deadline reached; stopping the probe")
+                        break
+                    # Probes share client_uuid/email, so the panel rejects duplicates if two variants both land
+                    won = await self._race(
+                        [
+                            lambda ep=ep, pf=pf: _attempt(ep, pf)
+                            for ep in group
+                            for pf in _probe_formats(ep, pass_formats)
+                            # The pinned pair was just tried; only race the others
+                            if (ep, pf) != cached
+                        ],
+                        accept=lambda r: r[2] in decisive,
+                    )
+                    if won is not None:
+                        break
+            return won
+
+        won = await _probe()
+        if (
+            won is None
+            and outcomes
+            and all(o == _Outcome.FALLBACK for o in outcomes)
+            and self.username
+            and self.password
+            and time.monotonic() < deadline_ts
+        ):
+            # Every endpoint turned the request down; after a panel restart that is a stale session (404s, or
+            # redirects to the login page on legacy panels), so log in again and probe once more before failing
+            self._log.info("Stage:add_client every endpoint refused; re-login and retry once")
+            if self._session.last_login_mono == login_seen:
+                self._session.last_login_mono = None
+            if await self._ensure_login(deadline_ts):
+                won = await _probe()
+        # Any HTTP reply (even 404s, 5xx or a refusal) closes the breaker, otherwise a half-open trial the panel
+        # did answer would leave it open another window. No reply at all, including a probe the deadline stopped
+        # before anything answered, is an outage.
+        if any(o not in (_Outcome.NO_REPLY, _Outcome.UNREACHABLE) for o in outcomes):
+            self._panel_ok()
+        else:
+            self._panel_failed()
+        if won is not None and won[2] in failed:
+            won = None
+        if won is not None and won[2] == _Outcome.PERMANENT:
+            self._log.error("Stage:add_client rejected by panel on %s%s", self.base_url, won[0])
+            return X3UICreateClientResult(uuid=client_uuid, note=email_note, config_url=None)
+        if won is not None:
+            ep, pf_name, outcome, config_url = won
+            self._remember_endpoint("addClient", (ep, pf_name))
+            self._session.flavor = _flavor_of(ep)
             full_url = f"{self.base_url}{ep}"
-            for pf_name, pf_payload in payloads:
-                try:
-                    self._log.info("Stage:add_client try %s with payload %s", full_url, pf_name)
-                    self._log.info("Payload: %s", json.dumps(pf_payload, indent=2))
-                    # Try JSON first
-                    headers_json = {
-                        "Accept": "application/json",
-                        "Content-Type": "application/json",
-                        "X-Requested-With": "XMLHttpRequest",
-                        "Referer": f"{self.base_url}/",
-                    }
-                    resp = await self._client.post(full_url, json=pf_payload, headers=headers_json)
-                    body = resp.text
-                    self._log.info("Stage:add_client resp %s -> %s %s", full_url, resp.status_code, body[:400])
-                    # If server complains about JSON parse, retry with raw JSON body
-                    if resp.status_code == 200 and body and "unexpected end of json input" in body.lower():
-                        try:
-                            raw = json.dumps(pf_payload)
-                            headers_raw = {
-                                "Accept": "application/json",
-                                "Content-Type": "application/json; charset=utf-8",
-                                "X-Requested-With": "XMLHttpRequest",
-                                "Referer": f"{self.base_url}/",
-                            }
-                            self._log.info("Stage:add_client retry(raw-json) %s", full_url)
-                            resp = await self._client.post(full_url, content=raw, headers=headers_raw)
-                            body = resp.text
-                            self._log.info("Stage:add_client resp(raw-json) %s -> %s %s", full_url, resp.status_code, body[:400])
-                        except Exception as e:
-                            self._log.debug("Stage:add_client raw-json retry failed: %s", e)
-                    # If still not ok, try form-encoded as a last resort
-                    if resp.status_code == 200 and (not body or body.strip() == ""):
-                        try:
-                            from urllib.parse import urlencode as _urlencode
-                            # For v2_str, send id/settings fields directly; for others, wrap in json field
-                            if pf_name == "v2_str" and isinstance(pf_payload, dict) and "id" in pf_payload and "settings" in pf_payload:
-                                form = _urlencode({"id": str(pf_payload["id"]), "settings": pf_payload["settings"]})
-                            else:
-                                form = _urlencode({"json": json.dumps(pf_payload)})
-                            headers_form = {
-                                "Accept": "application/json",
-                                "Content-Type": "application/x-www-form-urlencoded",
-                                "X-Requested-With": "XMLHttpRequest",
-                                "Referer": f"{self.base_url}/",
-                            }
-                            self._log.info("Stage:add_client retry(form) %s", full_url)
-                            resp = await self._client.post(full_url, content=form, headers=headers_form)
-                            body = resp.text
-                            self._log.info("Stage:add_client resp(form) %s -> %s %s", full_url, resp.status_code, body[:400])
-                        except Exception as e:
-                            self._log.debug("Stage:add_client form retry failed: %s", e)
-                    if resp.status_code == 200:
-                        # Parse success and extract link
-                        config_url: Optional[str] = None
-                        is_success = False
-                        try:
-                            data = resp.json()
-                            self._log.debug("Stage:add_client parsed JSON: %s", data)
-                            if isinstance(data, dict):
-                                success_flag = data.get("success")
-                                ok_flag = data.get("ok")
-                                status_val = str(data.get("status")).lower() if data.get("status") is not None else None
-                                code_val = data.get("code")
-                                is_success = (
-                                    success_flag is True
-                                    or ok_flag is True
-                                    or status_val in {"success", "ok"}
-                                    or code_val == 0
-                                )
-                                candidates: list[str] = []
-                                for key in ["link", "url", "config", "configUrl", "vless", "vmess", "trojan"]:
-                                    val = data.get(key)
-                                    if isinstance(val, str):
-                                        candidates.append(val)
-                                for container_key in ["obj", "data", "result", "client"]:
-                                    container = data.get(container_key)
-                                    if isinstance(container, dict):
-                                        for key in ["link", "url", "config", "configUrl", "vless", "vmess", "trojan"]:
-                                            val = container.get(key)
-                                            if isinstance(val, str):
-                                                candidates.append(val)
-                                    if isinstance(container, list):
-                                        for it in container:
-                                            if isinstance(it, dict):
-                                                for key in ["link", "url", "config", "configUrl", "vless", "vmess", "trojan"]:
-                                                    val = it.get(key)
-                                                    if isinstance(val, str):
-                                                        candidates.append(val)
-                                for c in candidates:
-                                    if isinstance(c, str) and (c.startswith("vless://") or c.startswith("vmess://") or c.startswith("trojan://")):
-                                        config_url = c
-                                        break
-                        except Exception:
-                            pass
-
-                        if is_success:
-                            if not config_url:
-                                # Try to fetch server-generated share link via follow-up endpoints
-                                try:
-                                    config_url = await self._fetch_config_url(inbound_id, email_note, client_uuid)
-                                except Exception:
-                                    config_url = None
-                            if config_url:
-                                self._log.info("Stage:add_client success using %s; config URL: %s", full_url, config_url)
-                            else:
-                                self._log.info("Stage:add_client success using %s; no link provided", full_url)
-                            return X3UICreateClientResult(uuid=client_uuid, note=email_note, config_url=config_url)
-                        else:
-                            self._log.warning("Stage:add_client body indicates failure on %s: %s", full_url, body)
-                    else:
-                        self._log.warning("Stage:add_client HTTP %s on %s: %s", resp.status_code, full_url, body)
-                except Exception as e:
-                    self._log.warning("Stage:add_client error on %s: %s", full_url, e)
-                    continue
+            if outcome == _Outcome.EXISTS:
+                self._log.info("Stage:add_client client %s already on panel; treating as created", client_uuid)
+            if not config_url:
+                # Try to fetch server-generated share link via follow-up endpoints
+                config_url = await self._fetch_config_url(inbound_id, email_note, client_uuid)
+            if config_url:
+                self._log.info("Stage:add_client success using %s; config URL: %s", full_url, config_url)
+            else:
+                self._log.info("Stage:add_client success using %s; no link provided", full_url)
+            return X3UICreateClientResult(uuid=client_uuid, note=email_note, config_url=config_url)
 
         self._log.error("Stage:add_client failed after all endpoints")
         # Do not generate the link locally; return without config URL
         return X3UICreateClientResult(uuid=client_uuid, note=email_note, config_url=None)
 
     async def get_inbound(self, inbound_id: int) -> Optional[dict]:
-        await self.login()
+        deadline_ts = time.monotonic() + _RETRY_BUDGET_SEC
+        await self._ensure_login(deadline_ts)
         self._log.info("Stage:get_inbound start id=%s", inbound_id)
-        subpaths = [
-            f"panel/api/inbounds/get/{inbound_id}",
-            "panel/api/inbounds/list",
-            f"api/inbounds/get/{inbound_id}",
-            "api/inbounds/list",
-        ]
-        paths = self._candidates(subpaths)
-        for ep in paths:
+        templates = self._live_endpoints(self._inbound_templates)
+
+        async def _try(tpl: str, known: bool = False) -> Optional[dict]:
+            ep = tpl.format(id=inbound_id)
             try:
-                full_url = f"{self.base_url}{ep}"
-                self._log.debug("Stage:get_inbound request %s", full_url)
-                resp = await self._client.get(full_url)
-                if resp.status_code == 200:
-                    data = resp.json()
-                    if isinstance(data, dict):
-                        obj = data.get("obj") if isinstance(data.get("obj"), (dict, list)) else None
-                        if obj is None:
-                            obj = data.get("data") if isinstance(data.get("data"), (dict, list)) else None
-                        if isinstance(obj, dict):
-                            if obj.get("id") == inbound_id or obj.get("port"):
-                                return obj
-                        if isinstance(obj, list):
-                            for it in obj:
-                                if it.get("id") == inbound_id:
-                                    return it
-            except Exception as e:
+                self._log.debug("Stage:get_inbound request %s%s", self.base_url, ep)
+                resp = await self._request("GET", ep, deadline_ts=deadline_ts, known=known)
+                if resp.status_code != 200:
+                    self._endpoint_failed(tpl)
+                    return None
+                self._endpoint_ok(tpl)
+                data = _json_loads(resp.content)
+            except _UNREACHABLE_ERRORS:
+                raise
+            except (httpx.HTTPError, ValueError) as e:
                 self._log.debug("Stage:get_inbound %s error: %s", ep, e)
-                continue
+                if isinstance(e, httpx.HTTPError) and not isinstance(e, _DeadlinePassed):
+                    self._endpoint_failed(tpl)
+                return None
+            if not isinstance(data, dict):
+                return None
+            obj = data.get("obj")
+            if not isinstance(obj, (dict, list)):
+                obj = data.get("data")
+            if isinstance(obj, dict):
+                if obj.get("id") == inbound_id or obj.get("port"):
+                    return _normalize_inbound(obj)
+            if isinstance(obj, list):
+                for it in obj:
+                    if isinstance(it, dict) and it.get("id") == inbound_id:
+                        return _normalize_inbound(it)
+            return None
+
+        async def _tagged(tpl: str) -> tuple[str, Optional[dict]]:
+            return tpl, await _try(tpl)
+
+        cached = self._cached_endpoint("get_inbound")
+        # Candidates are independent read-only GETs: run them concurrently and keep the first hit.
+        # get/{id} returns one inbound; list carries every inbound with its clientStats, so it is
+        # only downloaded when no get/{id} route answers.
+        by_id = tuple(tpl for tpl in templates if "{id}" in tpl and tpl != cached)
+        listing = tuple(tpl for tpl in templates if "{id}" not in tpl and tpl != cached)
+        won = None
+        try:
+            if cached:
+                # Template that worked last time: try it alone before probing
+                inbound = await _try(cached, known=True)
+                if inbound is not None:
+                    return inbound
+            for group in (by_id, listing):
+                won = await self._race(
+                    [lambda tpl=tpl: _tagged(tpl) for tpl in group], accept=lambda r: r[1] is not None
+                )
+                if won is not None:
+                    break
+        except _UNREACHABLE_ERRORS as e:
+            # Host down: the other templates would only wait out the same connect timeout
+            self._log.warning("Stage:get_inbound cannot connect to %s: %s", self.base_url, e)
+            return None
+        if won is not None:
+            self._remember_endpoint("get_inbound", won[0])
+            self._session.flavor = _flavor_of(won[0])
+            return won[1]
+        self._forget_endpoint("get_inbound")
         return None
 
     def build_vless_url(self, inbound: dict, client_uuid: str, note: str) -> Optional[str]:
+        # Debug arguments below (key lists, slices, dicts) are only built when DEBUG is enabled;
+        # tracing is a handful of summary lines rather than one call per field
+        dbg = self._log.debug if self._log.isEnabledFor(logging.DEBUG) else _noop
         try:
-            self._log.debug("build_vless_url called with inbound keys: %s", list(inbound.keys()))
+            if dbg is not _noop:
+                dbg("build_vless_url called with inbound keys: %s", list(inbound.keys()))
             protocol = (inbound.get("protocol") or "vless").lower()
-            self._log.debug("Protocol: %s", protocol)
             if protocol != "vless":
-                self._log.debug("Protocol is not vless, returning None")
+                dbg("Protocol is %s, not vless; returning None", protocol)
                 return None
             port = inbound.get("port")
-            self._log.debug("Port: %s", port)
-            stream_raw = inbound.get("streamSettings", {})
-            self._log.debug("StreamSettings raw: %s", stream_raw[:200] if isinstance(stream_raw, str) else stream_raw)
-            stream = stream_raw if isinstance(stream_raw, dict) else {}
-            try:
-                if isinstance(stream_raw, str):
-                    import json as _json
-                    stream = _json.loads(stream_raw)
-                    self._log.debug("Parsed stream: %s", stream)
-            except Exception as e:
-                self._log.debug("Failed to parse streamSettings: %s", e)
-                stream = {}
+            # get_inbound has already decoded these; _as_dict just passes dicts through
+            stream = _as_dict(inbound.get("streamSettings"))
             network = (stream.get("network") or "tcp").lower()
             security = (stream.get("security") or "none").lower()
-            self._log.debug("Network: %s, Security: %s", network, security)
 
             host = None
             path = None
             sni = None
 
             if network == "ws":
-                ws = stream.get("wsSettings", {})
+                ws = _as_dict(stream.get("wsSettings"))
                 path = ws.get("path") or "/"
                 headers = ws.get("headers") or {}
                 host = headers.get("Host") or headers.get("host")
+            reality: dict = {}
+            if security == "reality":
+                reality = _as_dict(stream.get("realitySettings"))
             if security in ("tls", "reality"):
-                tls = stream.get("tlsSettings") or stream.get("realitySettings") or {}
+                tls = _as_dict(stream.get("tlsSettings")) or reality
                 sni = tls.get("serverName")
 
-            # Derive server host from PUBLIC_BASE_URL or X3UI_BASE_URL if not present
-            from ..config import settings as app_settings
-            public_host = None
-            if app_settings.public_base_url:
-                try:
-                    from urllib.parse import urlparse
-                    parsed = urlparse(app_settings.public_base_url)
-                    if parsed.hostname:
-                        public_host = parsed.hostname
-                        self._log.debug("Public host from PUBLIC_BASE_URL: %s", public_host)
-                except Exception as e:
-                    self._log.debug("Failed to parse PUBLIC_BASE_URL: %s", e)
-                    pass
-            base_host = None
-            try:
-                from urllib.parse import urlparse as _urlparse
-                parsed_base = _urlparse(self.base_url)
-                if parsed_base.hostname:
-                    base_host = parsed_base.hostname
-                    self._log.debug("Base host from X3UI_BASE_URL: %s", base_host)
-            except Exception as e:
-                self._log.debug("Failed to parse X3UI_BASE_URL: %s", e)
-                base_host = None
-
-            # Build query params
-            params: dict[str, str] = {"encryption": "none"}
+            # Derive server host from PUBLIC_BASE_URL or X3UI_BASE_URL if not present (both parsed up front)
+            public_host = _PUBLIC_HOSTNAME
+            base_host = self._base_hostname
 
+            pbk = sid = sni_candidate = fp = spx = None
             if security == "reality":
-                self._log.debug("Building Reality protocol params")
-                params["security"] = "reality"
-                reality = stream.get("realitySettings", {})
-                # Handle both dict and string formats
-                if isinstance(reality, str):
-                    try:
-                        import json as _json
-                        reality = _json.loads(reality)
-                        self._log.debug("Parsed reality from string: %s", reality)
-                    except Exception as e:
-                        self._log.debug("Failed to parse reality string: %s", e)
-                        reality = {}
-                reality_inner = reality.get("settings", {}) if isinstance(reality.get("settings"), dict) else {}
-                # public key
-                pbk = reality_inner.get("publicKey") or reality.get("publicKey")
-                self._log.debug("Public key: %s", pbk)
-                # short id(s)
-                sid = None
-                if isinstance(reality.get("shortIds"), list) and reality.get("shortIds"):
-                    sid = reality.get("shortIds")[0]
-                elif isinstance(reality.get("shortId"), list) and reality.get("shortId"):
-                    sid = reality.get("shortId")[0]
-                elif isinstance(reality.get("shortId"), str):
-                    sid = reality.get("shortId")
-                self._log.debug("Short ID: %s", sid)
-                # sni/serverName
-                sni_candidate = reality_inner.get("serverName") or sni
-                self._log.debug("SNI candidate: %s", sni_candidate)
-                # spiderX and fingerprint
-                spx = reality_inner.get("spiderX") or reality.get("spiderX") or "/"
-                fp = reality_inner.get("fingerprint") or reality.get("fingerprint") or "chrome"
-                self._log.debug("SpiderX: %s, Fingerprint: %s", spx, fp)
-                if pbk:
-                    params["pbk"] = pbk
-                if sid:
-                    params["sid"] = sid
-                if sni_candidate:
-                    params["sni"] = sni_candidate
-                if fp:
-                    params["fp"] = fp
-                if spx:
-                    params["spx"] = spx
-                # network type (tcp/ws)
-                params["type"] = network
-                self._log.debug("Reality params: %s", params)
-            else:
-                if security and security != "none":
-                    params["security"] = security
-                if network == "ws":
-                    params["type"] = "ws"
-                    if path:
-                        params["path"] = path
-                    if host:
-                        params["host"] = host
+                r = reality
+                ri = r.get("settings")
+                if not isinstance(ri, dict):
+                    ri = {}
+                pbk = ri.get("publicKey") or r.get("publicKey")
+                # short id(s): a list under shortIds/shortId, or a single shortId string
+                sids = r.get("shortIds") or r.get("shortId")
+                sid = sids[0] if isinstance(sids, list) and sids else (sids if isinstance(sids, str) else None)
+                sni_candidate = ri.get("serverName") or sni
+                spx = ri.get("spiderX") or r.get("spiderX") or "/"
+                fp = ri.get("fingerprint") or r.get("fingerprint") or "chrome"
+                dbg("Reality pbk=%s sid=%s sni=%s spx=%s fp=%s", pbk, sid, sni_candidate, spx, fp)
+            # Reality links always carry the network type but never ws path/host; other links only do so for ws
+            ws_only = security != "reality" and network == "ws"
+            # Query params in the order share links conventionally use; unset (falsy) ones are dropped
+            candidates = (
+                ("encryption", "none"),
+                ("security", security if security != "none" else None),
+                ("pbk", pbk),
+                ("sid", sid),
+                ("sni", sni_candidate),
+                ("fp", fp),
+                ("spx", spx),
+                ("type", network if security == "reality" or network == "ws" else None),
+                ("path", path if ws_only else None),
+                ("host", host if ws_only else None),
+            )
+            # Keys are ASCII literals; only values need escaping
+            qs = "&".join(f"{k}={quote(str(v), safe='')}" for k, v in candidates if v)
 
             # Choose server host
             server = public_host or host or sni or base_host
-            self._log.debug("Final server host: %s (public_host=%s, host=%s, sni=%s, base_host=%s)", 
-                          server, public_host, host, sni, base_host)
             if not server or not port:
-                self._log.debug("Missing server (%s) or port (%s), returning None", server, port)
+                dbg("Missing server (%s) or port (%s), returning None", server, port)
                 return None
 
-            from urllib.parse import urlencode, quote
-            qs = urlencode(params)
-            tag = quote(note)
-            result = f"vless://{client_uuid}@{server}:{port}?{qs}#{tag}"
-            self._log.debug("Generated VLESS URL: %s", result)
+            result = _VLESS_TEMPLATE.format(
+                uuid=client_uuid, server=server, port=port, qs=qs, tag=quote(note, safe="")
+            )
+            dbg(
+                "Generated VLESS URL: %s (network=%s security=%s server=%s: public_host=%s host=%s sni=%s base_host=%s)",
+                result, network, security, server, public_host, host, sni, base_host,
+            )
             return result
-        except Exception as e:
-            self._log.debug("Exception in build_vless_url: %s", e)
-            return None
\ No newline at end of file
+        except (AttributeError, TypeError, ValueError) as e:
+            # Malformed inbound settings (unexpected types in nested fields)
+            dbg("Exception in build_vless_url: %s", e)
+            return None
+
+
+# (base_url, username, password) -> long-lived client; everything it holds is per panel, so one instance serves all callers
+_x3ui_clients: dict[tuple[str, Optional[str], Optional[str]], X3UIClient] = {}
+
+
+def get_x3ui_client(base_url: str, username: Optional[str], password: Optional[str]) -> X3UIClient:
+    """Shared X3UIClient for a panel; `async with` on it is a no-op, it is released by close_shared_clients()."""
+    key = (base_url.rstrip("/"), username, password)
+    client = _x3ui_clients.get(key)
+    if client is None or client._client.is_closed:
+        client = _x3ui_clients[key] = X3UIClient(base_url, username, password)
+    return client
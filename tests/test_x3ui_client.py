@@ -0,0 +1,186 @@
+"""X3UIClient against an in-process fake panel (httpx.MockTransport).
+
+Run with: python -m unittest discover -s tests -t .
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+import unittest
+from unittest import mock
+
+import httpx
+
+from app.x3ui import client as x3ui
+
+BASE_URL = "https://panel.test"
+LINK = "vless://client@panel.test:443?encryption=none#tg"
+
+
+class FakePanel:
+    """Modern 3x-ui: JSON login, version 2.x, addClient under /panel/api/, 404 for anything unauthenticated."""
+
+    def __init__(self) -> None:
+        self.token = "s1"
+        self.up = True
+        self.calls: list[tuple[str, str]] = []
+        self.timeouts: list[float] = []
+
+    def logins(self) -> int:
+        return sum(1 for _, path in self.calls if path == "/login")
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        self.calls.append((request.method, request.url.path))
+        self.timeouts.append(request.extensions["timeout"]["read"])
+        if not self.up:
+            raise httpx.ConnectError("connection refused", request=request)
+        path = request.url.path
+        if path == "/login":
+            return httpx.Response(
+                200, json={"success": True, "msg": ""}, headers={"set-cookie": f"3x-ui={self.token}; Path=/"}
+            )
+        if request.headers.get("cookie") != f"3x-ui={self.token}":
+            return httpx.Response(404)
+        if path == "/panel/api/server/status":
+            return httpx.Response(200, json={"success": True, "obj": {"version": "2.4.0"}})
+        if path == "/panel/api/inbounds/addClient":
+            settings = json.loads(json.loads(request.content)["settings"])
+            assert settings["clients"][0]["email"].startswith("tg_")
+            return httpx.Response(200, json={"success": True, "msg": "", "obj": {"link": LINK}})
+        return httpx.Response(404)
+
+
+class X3UIClientTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        # Sessions, endpoint pins and breakers are per process; every test starts from a cold panel
+        x3ui._panel_sessions.clear()
+        x3ui._shared_clients.clear()
+        x3ui.X3UIClient._endpoint_cache.clear()
+        x3ui.X3UIClient._breakers.clear()
+        logging.getLogger("x3ui").setLevel(logging.CRITICAL)
+        for name, value in (("_BACKOFF_BASE_SEC", 0.001), ("_BACKOFF_CAP_SEC", 0.01)):
+            patcher = mock.patch.object(x3ui, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.panel = FakePanel()
+
+    def make_client(self, handler=None) -> x3ui.X3UIClient:
+        client = x3ui.X3UIClient(BASE_URL, "user", "pass")
+        client._client = httpx.AsyncClient(
+            base_url=BASE_URL, transport=httpx.MockTransport(handler or self.panel.handler)
+        )
+        self.addAsyncCleanup(client._client.aclose)
+        return client
+
+
+class SessionTest(X3UIClientTestCase):
+    async def test_session_is_reused_until_it_expires(self) -> None:
+        client = self.make_client()
+        result = await client.add_client(1, 30, None, "tg_1_a")
+        self.assertEqual(result.config_url, LINK)
+        self.assertEqual(self.panel.logins(), 1)
+
+        await client.add_client(1, 30, None, "tg_1_b")
+        self.assertEqual(self.panel.logins(), 1)
+
+        client._session.last_login_mono -= client._login_ttl_sec + 1
+        await client.add_client(1, 30, None, "tg_1_c")
+        self.assertEqual(self.panel.logins(), 2)
+
+    async def test_stale_session_answered_with_404_logs_in_again(self) -> None:
+        client = self.make_client()
+        await client.add_client(1, 30, None, "tg_1_a")
+        self.panel.token = "s2"  # panel restart: the cookie we hold is no longer valid
+        seen = len(self.panel.calls)
+
+        result = await client.add_client(1, 30, None, "tg_1_b")
+
+        self.assertEqual(result.config_url, LINK)
+        self.assertEqual(
+            self.panel.calls[seen:],
+            [
+                ("POST", "/panel/api/inbounds/addClient"),
+                ("POST", "/login"),
+                ("POST", "/panel/api/inbounds/addClient"),
+            ],
+        )
+
+    async def test_unanswered_cold_probe_retries_after_fresh_login(self) -> None:
+        client = self.make_client()
+        await client.add_client(1, 30, None, "tg_1_a")
+        x3ui.X3UIClient._endpoint_cache.clear()  # nothing pinned: the whole probe runs on the stale session
+        self.panel.token = "s2"
+
+        result = await client.add_client(1, 30, None, "tg_1_b")
+
+        self.assertEqual(result.config_url, LINK)
+        self.assertEqual(self.panel.logins(), 2)
+
+
+class PanelBreakerTest(X3UIClientTestCase):
+    async def test_opens_after_outages_then_half_opens_and_closes(self) -> None:
+        client = self.make_client()
+        self.panel.up = False
+        with mock.patch.object(x3ui, "_PANEL_BREAKER_OPEN_SEC", 0.05):
+            for i in range(x3ui._BREAKER_THRESHOLD):
+                result = await client.add_client(1, 30, None, f"tg_1_{i}")
+                self.assertIsNone(result.config_url)
+            self.assertEqual(client._session.outages, x3ui._BREAKER_THRESHOLD)
+
+            # Open: fail fast without touching the panel
+            seen = len(self.panel.calls)
+            result = await client.add_client(1, 30, None, "tg_1_open")
+            self.assertIsNone(result.config_url)
+            self.assertEqual(len(self.panel.calls), seen)
+
+            # Half-open: one trial goes through, concurrent callers keep failing fast
+            await asyncio.sleep(0.06)
+            self.assertFalse(client._panel_open())
+            self.assertTrue(client._panel_open())
+            client._session.open_until = 0.0
+
+            self.panel.up = True
+            result = await client.add_client(1, 30, None, "tg_1_trial")
+
+        self.assertEqual(result.config_url, LINK)
+        self.assertEqual(client._session.outages, 0)
+        self.assertFalse(client._panel_open())
+
+    async def test_any_http_answer_closes_it(self) -> None:
+        client = self.make_client(lambda request: httpx.Response(404))
+        client._session.outages = x3ui._BREAKER_THRESHOLD
+
+        result = await client.add_client(1, 30, None, "tg_1_a")
+
+        self.assertIsNone(result.config_url)
+        self.assertEqual(client._session.outages, 0)
+
+
+class DeadlineTest(X3UIClientTestCase):
+    async def test_blackholed_panel_returns_within_the_budget(self) -> None:
+        async def blackhole(request: httpx.Request) -> httpx.Response:
+            self.panel.timeouts.append(request.extensions["timeout"]["connect"])
+            await asyncio.sleep(min(0.2, request.extensions["timeout"]["connect"]))
+            raise httpx.ConnectTimeout("timed out", request=request)
+
+        client = self.make_client(blackhole)
+        with mock.patch.object(x3ui, "_ADD_CLIENT_BUDGET_SEC", 0.5):
+            started = time.monotonic()
+            result = await client.add_client(1, 30, None, "tg_1_a")
+            elapsed = time.monotonic() - started
+
+        self.assertIsNone(result.config_url)
+        self.assertLess(elapsed, 0.8)
+        self.assertTrue(all(t <= 0.5 for t in self.panel.timeouts))
+        self.assertEqual(client._session.outages, 1)
+
+    async def test_explicit_deadline_shortens_request_timeouts(self) -> None:
+        client = self.make_client()
+        await client.add_client(1, 30, None, "tg_1_a", deadline=time.monotonic() + 1.0)
+        self.assertTrue(all(t <= 1.0 for t in self.panel.timeouts))
+
+
+if __name__ == "__main__":
+    unittest.main()